@@ -0,0 +1,280 @@
+import argparse
+import glob
+import inspect
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import cv2
+from image_processor import EDIT_OPERATIONS, IN_PLACE_OPERATIONS, ImageProcessor
+from resizer import RESIZE_MODES
+from tiled_image import TiledImage
+
+
+# Short names used on the command line and the ImageProcessor method they run
+OPERATION_ALIASES = {
+    "grayscale": "to_grayscale",
+    "blur": "apply_blur",
+    "edges": "detect_edges",
+    "brightness": "adjust_brightness",
+    "contrast": "adjust_contrast",
+    "rotate": "rotate_image",
+    "flip": "flip_image",
+    "resize": "resize_image",
+}
+
+# What every value of an operation must be, in parameter order: (check, description used in the error)
+_whole = lambda v: isinstance(v, int) and not isinstance(v, bool)
+_number = lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)
+ARGUMENT_CHECKS = {
+    # Level 0 of the blur slider is a valid (1 pixel) kernel
+    "apply_blur": [(lambda v: _whole(v) and v >= 0, "a whole number of at least 0")],
+    "adjust_brightness": [(_number, "a number")],
+    "adjust_contrast": [(_number, "a number")],
+    "rotate_image": [(lambda v: _whole(v) and v in (0, 90, 180, 270), "0, 90, 180 or 270")],
+    "flip_image": [(lambda v: _whole(v) and v in (-1, 0, 1), "-1, 0 or 1")],
+    "resize_image": [(lambda v: _whole(v) and v >= 1, "a whole number of at least 1")] * 2
+                    + [(lambda v: v in RESIZE_MODES, " or ".join(RESIZE_MODES))],
+}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def parse_operations(text):
+    """This function will parse an operation list like "grayscale, blur 7, resize 1024x768" into a list of (method name, args...) tuples."""
+    operations = []
+    for part in text.split(","):
+        tokens = part.split()
+        if not tokens:
+            continue
+        name = OPERATION_ALIASES.get(tokens[0].lower(), tokens[0])
+        # Only the editing operations can be named, not helpers like run_pipeline or buffer
+        if name not in EDIT_OPERATIONS:
+            raise ValueError(f"Unknown operation: {tokens[0]}")
+        args = []
+        for token in tokens[1:]:
+            try:
+                if token.lower() in RESIZE_MODES:
+                    args.append(token.lower())
+                elif "x" in token.lower():
+                    # Sizes are written as <width>x<height> in whole pixels
+                    args.extend(int(v) for v in token.lower().split("x"))
+                elif "." in token:
+                    args.append(float(token))
+                else:
+                    args.append(int(token))
+            except ValueError:
+                raise ValueError(f"{tokens[0]}: can't read the value {token!r}") from None
+        check_arguments(tokens[0], name, args)
+        operations.append((name, *args))
+    return operations
+
+
+def check_arguments(label, name, args):
+    """This function will raise a ValueError if args don't fit the parameters of the ImageProcessor method (their number and, see ARGUMENT_CHECKS, their values), so a wrong operation list fails before any file is processed."""
+    # The image and the optional out array are never given on the command line
+    params = [p for p in inspect.signature(getattr(ImageProcessor, name)).parameters.values()
+              if p.name not in ("image", "out")]
+    required = sum(p.default is inspect.Parameter.empty for p in params)
+    if not required <= len(args) <= len(params):
+        names = " ".join(p.name if p.default is inspect.Parameter.empty else f"[{p.name}]" for p in params)
+        raise ValueError(f"{label} expects {names or 'no arguments'}, got {len(args)}")
+    for param, value, (check, description) in zip(params, args, ARGUMENT_CHECKS.get(name, [])):
+        if not check(value):
+            raise ValueError(f"{label}: {param.name} must be {description}, got {value!r}")
+
+
+def collect_inputs(patterns):
+    """This function will expand directories and glob patterns into a sorted list of image files."""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, names in os.walk(pattern):
+                files.extend(os.path.join(root, n) for n in names
+                             if n.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            files.extend(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+    return sorted(set(files))
+
+
+def write_params(extension, quality, png_compression):
+    """This function will return the cv2.imwrite parameters for the given output format."""
+    if extension in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if extension == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    if extension == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    return []
+
+
+def process_file(src, dst, operations, params, tile_size=None, tile_workers=None):
+    """This function runs inside a worker process, applies the operations to one image and writes the result. It returns the input size, output size and the time spent in every operation. With a tile size the image is processed out-of-core through TiledImage."""
+    if tile_size:
+        return process_tiled(src, dst, operations, params, tile_size, tile_workers)
+    timings = {}
+    # Grayscale files stay single-channel
+    image = cv2.imread(src, cv2.IMREAD_ANYCOLOR)
+    if image is None:
+        raise ValueError(f"Could not load image: {src}")
+    for name, *args in operations:
+        start = time.perf_counter()
+        method = getattr(ImageProcessor, name)
+        if name in IN_PLACE_OPERATIONS:
+            # The decoded image isn't needed afterwards, so it is overwritten instead of allocating a copy
+            image = method(image, *args, out=image)
+        else:
+            image = method(image, *args)
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    if not cv2.imwrite(dst, image, params):
+        raise ValueError(f"Could not write image: {dst}")
+    return os.path.getsize(src), os.path.getsize(dst), timings
+
+
+def process_tiled(src, dst, operations, params, tile_size, tile_workers):
+    """This function will process one image tile by tile from a memory-mapped copy so images larger than RAM can be handled."""
+    start = time.perf_counter()
+    source = TiledImage.from_file(src, tile_size=tile_size)
+    try:
+        result = source.run_operations(operations, workers=tile_workers)
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        result.save(dst, params)
+        if result is not source:
+            result.close(delete=True)
+    finally:
+        if source.path != src:
+            source.close(delete=True)
+    # Operations run fused per tile, so the time is reported for the whole chain
+    timings = {"tiled " + "+".join(name for name, *_ in operations): time.perf_counter() - start}
+    return os.path.getsize(src), os.path.getsize(dst), timings
+
+
+def output_path(src, base, output_dir, extension):
+    """This function will return where the result of src is written, keeping its path relative to the input directory."""
+    rel = os.path.relpath(src, base) if base else os.path.basename(src)
+    stem, ext = os.path.splitext(rel)
+    return os.path.join(output_dir, stem + (extension or ext))
+
+
+def common_base(files):
+    """This function will return the deepest directory that contains all files, so outputs of inputs from different directories keep apart (a/x.jpg and b/x.jpg become <output>/a/x.jpg and <output>/b/x.jpg)."""
+    try:
+        return os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+    except ValueError:
+        # Files on different drives have no common directory
+        return None
+
+
+def output_paths(files, base, output_dir, extension):
+    """This function will return a dictionary from every input file to where its result is written, raising a ValueError if two inputs would be written to the same file (e.g. x.png and x.jpg converted to the same format)."""
+    destinations = {}
+    claimed = {}
+    for src in files:
+        dst = output_path(os.path.abspath(src), base, output_dir, extension)
+        key = os.path.normcase(os.path.abspath(dst))
+        if key in claimed:
+            raise ValueError(f"{claimed[key]} and {src} would both be written to {dst}")
+        claimed[key] = src
+        destinations[src] = dst
+    return destinations
+
+
+def run_batch(files, operations, output_dir, extension=None, quality=95, png_compression=3,
+              workers=None, queue_size=None, base=None, tile_size=None, tile_workers=None):
+    """This function will process all files across a pool of worker processes. At most queue_size images are in flight at a time so memory stays bounded however many files there are. Outputs keep their path relative to base, which defaults to the directory containing all files. It returns a summary dictionary, or raises a ValueError before anything is processed if two files would be written to the same output."""
+    destinations = output_paths(files, os.path.abspath(base) if base else common_base(files), output_dir, extension)
+    workers = workers or os.cpu_count() or 1
+    queue_size = queue_size or workers * 2
+    summary = {"images": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0, "op_time": {}}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        remaining = iter(files)
+        while True:
+            # Keep the queue topped up without submitting everything at once
+            while len(pending) < queue_size:
+                src = next(remaining, None)
+                if src is None:
+                    break
+                dst = destinations[src]
+                ext = os.path.splitext(dst)[1].lower()
+                params = write_params(ext, quality, png_compression)
+                pending[pool.submit(process_file, src, dst, operations, params,
+                                    tile_size, tile_workers)] = src
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                src = pending.pop(future)
+                try:
+                    bytes_in, bytes_out, timings = future.result()
+                except Exception as e:
+                    summary["failed"] += 1
+                    print(f"Error: {src}: {e}", file=sys.stderr)
+                    continue
+                summary["images"] += 1
+                summary["bytes_in"] += bytes_in
+                summary["bytes_out"] += bytes_out
+                for name, seconds in timings.items():
+                    summary["op_time"][name] = summary["op_time"].get(name, 0.0) + seconds
+
+    summary["elapsed"] = time.perf_counter() - start
+    return summary
+
+
+def print_summary(summary):
+    """This function will print the throughput of a finished batch run."""
+    elapsed = max(summary["elapsed"], 1e-9)
+    count = summary["images"]
+    print(f"Processed {count} images ({summary['failed']} failed) in {elapsed:.2f} s")
+    print(f"Throughput: {count / elapsed:.2f} images/s, "
+          f"{summary['bytes_in'] / elapsed / 1e6:.2f} MB/s read, "
+          f"{summary['bytes_out'] / elapsed / 1e6:.2f} MB/s written")
+    for name, seconds in summary["op_time"].items():
+        print(f"  {name:<18} {seconds * 1000 / max(count, 1):8.2f} ms/image")
+
+
+def main(argv=None):
+    """This function is the command line entry point of the batch processor."""
+    parser = argparse.ArgumentParser(
+        description="Apply a list of image operations to directories or globs of images.")
+    parser.add_argument("inputs", nargs="+", help="Image files, directories or glob patterns")
+    parser.add_argument("-p", "--ops", required=True,
+                        help='Operations to apply, e.g. "grayscale, blur 7, resize 1024x768"')
+    parser.add_argument("-o", "--output", required=True, help="Output directory")
+    parser.add_argument("-f", "--format", help="Output format (jpg, png, webp, bmp); default keeps the input format")
+    parser.add_argument("-q", "--quality", type=int, default=95, help="JPEG/WebP quality (0-100)")
+    parser.add_argument("--png-compression", type=int, default=3, help="PNG compression level (0-9)")
+    parser.add_argument("-j", "--workers", type=int, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--queue-size", type=int, help="Maximum number of images in flight (default: 2 x workers)")
+    parser.add_argument("--tile", type=int, metavar="SIZE",
+                        help="Process images out-of-core in SIZE x SIZE tiles (for images larger than RAM; resize isn't supported)")
+    parser.add_argument("--tile-workers", type=int, help="Threads per image when tiling (default: all cores)")
+    args = parser.parse_args(argv)
+
+    try:
+        operations = parse_operations(args.ops)
+    except ValueError as e:
+        parser.error(str(e))
+    files = collect_inputs(args.inputs)
+    if not files:
+        parser.error("No input images found.")
+
+    # Keep the directory structure when a single directory is processed
+    base = args.inputs[0] if len(args.inputs) == 1 and os.path.isdir(args.inputs[0]) else None
+    extension = "." + args.format.lower().lstrip(".") if args.format else None
+    # A tiled image already uses every core, so images are then processed one at a time by default
+    workers = args.workers or (1 if args.tile else None)
+    try:
+        summary = run_batch(files, operations, args.output, extension, args.quality,
+                            args.png_compression, workers, args.queue_size, base, args.tile, args.tile_workers)
+    except ValueError as e:
+        parser.error(str(e))
+    print_summary(summary)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from history_manager import HistoryManager
+from image_processor import ImageProcessor
+from resizer import resize
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, so rss_bytes asks the Win32 API instead
+    resource = None
+    import ctypes
+    from ctypes import wintypes
+
+
+# Image sizes (megapixels) and channel counts of the default matrix
+DEFAULT_SIZES = [0.3, 1, 4, 12, 24, 50]
+DEFAULT_CHANNELS = [1, 3]
+
+# Arguments every ImageProcessor method is benchmarked with, given the input image
+OPERATION_ARGS = {
+    "to_grayscale": lambda img: (),
+    "to_grayscale_bgr": lambda img: (),
+    "apply_blur": lambda img: (15,),
+    "detect_edges": lambda img: (),
+    "adjust_brightness": lambda img: (40,),
+    "adjust_contrast": lambda img: (1.5,),
+    "rotate_image": lambda img: (90,),
+    "flip_image": lambda img: (1,),
+    "resize_image": lambda img: (img.shape[1] // 2, img.shape[0] // 2),
+    "run_pipeline": lambda img: ([("adjust_contrast", 1.2), ("rotate_image", 90), ("adjust_contrast", 0.9)],),
+}
+
+# Edit applied repeatedly to build the undo/redo history
+HISTORY_OPERATION = ("adjust_contrast", 1.1)
+
+# Edit used to measure the peak memory of one edit as the editor does it (filter plus history push)
+EDIT_OPERATION = ("adjust_brightness", 40)
+
+# Values the random chains of check_pipeline pick their operations from
+PIPELINE_CHOICES = {
+    "to_grayscale": [()],
+    "to_grayscale_bgr": [()],
+    "apply_blur": [(1,), (4,), (7,)],
+    "detect_edges": [()],
+    "adjust_brightness": [(-80,), (-15,), (25,), (90,)],
+    "adjust_contrast": [(0.4,), (0.9,), (1.3,), (2.5,)],
+    "rotate_image": [(0,), (90,), (180,), (270,)],
+    "flip_image": [(-1,), (0,), (1,)],
+    "resize_image": [(40, 30), (64, 64, "fit"), (50, 20, "fill")],
+}
+
+# Scale factors resizer.resize is compared at against the single INTER_AREA cv2.resize call resize_image used to make
+RESIZE_FACTORS = [0.5, 0.35, 0.1, 1.5, 4.0]
+
+
+def make_image(megapixels, channels, smooth=False):
+    """This function will create a reproducible test image of about the given size with a 4:3 aspect ratio. A smooth image compresses like a photo, while the default noise is the worst case."""
+    w = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    h = int(w * 3 / 4)
+    shape = (h, w) if channels == 1 else (h, w, channels)
+    image = np.empty(shape, dtype=np.uint8)
+    # Filled in place so creating the input doesn't raise the peak memory
+    cv2.setRNGSeed(1234)
+    if smooth:
+        small = np.empty((h // 16, w // 16) + shape[2:], dtype=np.uint8)
+        cv2.randu(small, 0, 256)
+        cv2.resize(small, (w, h), dst=image, interpolation=cv2.INTER_LINEAR)
+    else:
+        cv2.randu(image, 0, 256)
+    return image
+
+
+def _peak_working_set():
+    """This function will return the peak working set of this process in bytes, the Windows counterpart of ru_maxrss."""
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+            (name, ctypes.c_size_t) for name in (
+                "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+    # Declared so the handle isn't cut to a 32-bit int on 64-bit Windows
+    get_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_process.restype = wintypes.HANDLE
+    get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not get_info(get_process(), ctypes.byref(counters), counters.cb):
+        raise ctypes.WinError()
+    return counters.PeakWorkingSetSize
+
+
+def rss_bytes():
+    """This function will return the peak resident memory of this process in bytes."""
+    if resource is None:
+        return _peak_working_set()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def bench_operation(name, megapixels, channels, repeat):
+    """This function runs in a fresh process, times one ImageProcessor method on one input and measures how much the peak memory grew."""
+    image = make_image(megapixels, channels)
+    args = OPERATION_ARGS[name](image)
+    method = getattr(ImageProcessor, name)
+    baseline = rss_bytes()
+    times = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            method(image, *args)
+            times.append(time.perf_counter() - start)
+    except cv2.error:
+        return {"skipped": f"{channels}-channel input not supported"}
+    return _timing_result(times, image, baseline)
+
+
+def bench_history(megapixels, channels, depth):
+    """This function runs in a fresh process, pushes depth edits into a HistoryManager and times undoing and redoing all of them."""
+    image = make_image(megapixels, channels)
+    baseline = rss_bytes()
+    history = HistoryManager()
+    name, *args = HISTORY_OPERATION
+
+    start = time.perf_counter()
+    current = image
+    for _ in range(depth):
+        result = getattr(ImageProcessor, name)(current, *args)
+        history.push_state(current, result, HISTORY_OPERATION)
+        current = result
+    push = time.perf_counter() - start
+
+    start = time.perf_counter()
+    while (previous := history.undo(current)) is not None:
+        current = previous
+    undo = time.perf_counter() - start
+
+    start = time.perf_counter()
+    while (following := history.redo(current)) is not None:
+        current = following
+    redo = time.perf_counter() - start
+
+    # Steps over the budget are compressed in the background, wait for them before measuring
+    history.flush()
+    result = _timing_result([push + undo + redo], image, baseline)
+    result.update({
+        "push_s": push, "undo_s": undo, "redo_s": redo, "depth": depth,
+        "history_mb": history.memory_usage() / 1e6,
+    })
+    return result
+
+
+def bench_edit(megapixels, channels):
+    """This function runs in a fresh process and measures one edit the way the editor does it: the filter writes a new image and the old one is pushed into the history without a copy. delta_mb is the size of the compressed delta the step shrinks to once the history is over its budget."""
+    image = make_image(megapixels, channels, smooth=True)
+    baseline = rss_bytes()
+    history = HistoryManager()
+    name, *args = EDIT_OPERATION
+    start = time.perf_counter()
+    try:
+        result = getattr(ImageProcessor, name)(image, *args)
+    except cv2.error:
+        return {"skipped": f"{channels}-channel input not supported"}
+    entry = history.encode(image, result, EDIT_OPERATION)
+    history.push_entry(entry)
+    result = _timing_result([time.perf_counter() - start], image, baseline)
+    result["history_mb"] = history.memory_usage() / 1e6
+    result["delta_mb"] = len(history.entry_data(entry)) / 1e6
+    return result
+
+
+def bench_resize(megapixels, channels, factor, repeat):
+    """This function runs in a fresh process and times resizer.resize at one scale factor against a single cv2.resize call with INTER_AREA, reporting the speedup."""
+    image = make_image(megapixels, channels, smooth=True)
+    if factor > 1:
+        # Enlarging the full size inputs would need gigabytes, so a smaller image is enlarged to about the case size
+        h, w = image.shape[:2]
+        image = cv2.resize(image, (max(1, round(w / factor)), max(1, round(h / factor))), interpolation=cv2.INTER_AREA)
+    h, w = image.shape[:2]
+    size = (max(1, round(w * factor)), max(1, round(h * factor)))
+    baseline = rss_bytes()
+    times, plain = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resize(image, *size)
+        times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        plain.append(time.perf_counter() - start)
+    result = _timing_result(times, image, baseline)
+    result["baseline_s"] = statistics.median(plain)
+    result["speedup"] = result["baseline_s"] / result["median_s"]
+    return result
+
+
+def check_pipeline(chains, seed=0, log=print):
+    """This function will run random chains of operations through ImageProcessor.run_pipeline and one method at a time on small 1 and 3 channel images, and return the chains whose results are not pixel-identical."""
+    rng = np.random.default_rng(seed)
+    names = list(PIPELINE_CHOICES)
+    # Odd sizes catch rounding at the row ends, and a non-square image catches mixed up rotations
+    images = [rng.integers(0, 256, (37, 53), dtype=np.uint8), rng.integers(0, 256, (37, 53, 3), dtype=np.uint8)]
+    failures = []
+    for _ in range(chains):
+        image = images[rng.integers(len(images))]
+        operations = []
+        for _ in range(rng.integers(1, 7)):
+            name = names[rng.integers(len(names))]
+            choices = PIPELINE_CHOICES[name]
+            operations.append((name, *choices[rng.integers(len(choices))]))
+        expected = image
+        for name, *args in operations:
+            expected = getattr(ImageProcessor, name)(expected, *args)
+        result = ImageProcessor.run_pipeline(image, operations)
+        if result.shape != expected.shape or not np.array_equal(result, expected):
+            failures.append((image.shape, operations))
+            log(f"  {image.shape}: {operations}")
+    return failures
+
+
+def _timing_result(times, image, baseline):
+    """This function will turn a list of timings into the result dictionary stored in the JSON file."""
+    median = statistics.median(times)
+    peak = rss_bytes()
+    return {
+        "median_s": median,
+        "min_s": min(times),
+        "mp_per_s": image.shape[0] * image.shape[1] / 1e6 / median,
+        "mb_per_s": image.nbytes / 1e6 / median,
+        "peak_rss_mb": peak / 1e6,
+        # Memory needed on top of the input image
+        "extra_rss_mb": max(peak - baseline, 0) / 1e6,
+        "input_mb": image.nbytes / 1e6,
+        # Peak memory of the case (input included) in multiples of the image size
+        "peak_ratio": 1 + max(peak - baseline, 0) / image.nbytes,
+    }
+
+
+def run_suite(sizes, channels, operations, repeat, history_depth, resize_factors=(), log=print):
+    """This function will run every case of the matrix in its own process so peak memory is measured per case, and return the list of results."""
+    cases = [(name, mp, ch) for mp in sizes for ch in channels for name in operations]
+    cases += [("edit", mp, ch) for mp in sizes for ch in channels]
+    cases += [(f"resize_x{factor}", mp, ch) for mp in sizes for ch in channels for factor in resize_factors]
+    if history_depth:
+        cases += [("history", mp, ch) for mp in sizes for ch in channels]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name, mp, ch in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            if name == "history":
+                result = pool.submit(bench_history, mp, ch, history_depth).result()
+            elif name == "edit":
+                result = pool.submit(bench_edit, mp, ch).result()
+            elif name.startswith("resize_x"):
+                result = pool.submit(bench_resize, mp, ch, float(name[len("resize_x"):]), repeat).result()
+            else:
+                result = pool.submit(bench_operation, name, mp, ch, repeat).result()
+        result.update({"name": name, "megapixels": mp, "channels": ch})
+        results.append(result)
+        if "skipped" in result:
+            log(f"{name:<18} {mp:>5} MP x{ch}  skipped: {result['skipped']}")
+        else:
+            speedup = f"  {result['speedup']:.2f}x faster than INTER_AREA" if "speedup" in result else ""
+            log(f"{name:<18} {mp:>5} MP x{ch}  {result['median_s'] * 1000:9.2f} ms  "
+                f"{result['mp_per_s']:8.1f} MP/s  +{result['extra_rss_mb']:7.1f} MB ({result['peak_ratio']:.2f}x){speedup}")
+    return results
+
+
+def case_key(result):
+    """This function will return the key that identifies a case between runs."""
+    return f"{result['name']}/{result['megapixels']}MP/{result['channels']}ch"
+
+
+def compare(results, baseline, threshold):
+    """This function will compare results against a baseline and return a list of messages for every case that got slower (or needs more memory) by more than threshold."""
+    previous = {case_key(r): r for r in baseline["results"] if "skipped" not in r}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None or "skipped" in result:
+            continue
+        # Differences below 0.1 ms are timer noise on the smallest inputs
+        if result["median_s"] > max(old["median_s"] * (1 + threshold), old["median_s"] + 1e-4):
+            regressions.append(f"{case_key(result)}: {old['median_s'] * 1000:.2f} ms -> "
+                               f"{result['median_s'] * 1000:.2f} ms")
+        # Small absolute changes in memory are noise, so a 1 MB floor is applied
+        if result["extra_rss_mb"] > max(old["extra_rss_mb"] * (1 + threshold), old["extra_rss_mb"] + 1):
+            regressions.append(f"{case_key(result)}: +{old['extra_rss_mb']:.1f} MB -> "
+                               f"+{result['extra_rss_mb']:.1f} MB peak memory")
+    return regressions
+
+
+def main(argv=None):
+    """This function is the command line entry point of the benchmark suite."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark ImageProcessor and HistoryManager and check for regressions.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="Image sizes in megapixels")
+    parser.add_argument("--channels", type=int, nargs="+", default=DEFAULT_CHANNELS, choices=[1, 3])
+    parser.add_argument("--ops", nargs="+", default=list(OPERATION_ARGS), choices=list(OPERATION_ARGS),
+                        help="ImageProcessor methods to run")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (the median is reported)")
+    parser.add_argument("--history-depth", type=int, default=20, help="Number of edits for the undo/redo case (0 to skip)")
+    parser.add_argument("--resize-factors", type=float, nargs="*", default=RESIZE_FACTORS,
+                        help="Scale factors to compare resizer.resize at against plain INTER_AREA (none to skip)")
+    parser.add_argument("--quick", action="store_true", help="Only run the 0.3 and 1 MP sizes")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown before a case counts as a regression")
+    parser.add_argument("--check-memory", type=float, metavar="RATIO",
+                        help="Fail if the peak memory of an edit (inputs >= 12 MP) exceeds RATIO x the image size, e.g. 2.5")
+    parser.add_argument("--check-pipeline", type=int, metavar="CHAINS",
+                        help="Only check that run_pipeline is pixel-identical to running the methods one at a time on CHAINS random operation chains, e.g. 3000")
+    args = parser.parse_args(argv)
+
+    if args.check_pipeline:
+        failures = check_pipeline(args.check_pipeline)
+        print(f"{len(failures)} of {args.check_pipeline} operation chains differ from running the methods one at a time")
+        return 1 if failures else 0
+
+    sizes = [0.3, 1] if args.quick else args.sizes
+    results = run_suite(sizes, args.channels, args.ops, args.repeat, args.history_depth, args.resize_factors)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = False
+    if args.check_memory:
+        # Small inputs are dominated by allocator and library overhead
+        over = [r for r in results if r["name"] == "edit" and "skipped" not in r
+                and r["megapixels"] >= 12 and r["peak_ratio"] > args.check_memory]
+        for r in over:
+            print(f"  {case_key(r)}: peak memory {r['peak_ratio']:.2f}x image size")
+        if over:
+            print(f"{len(over)} edit(s) above {args.check_memory}x the image size")
+            failed = True
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}:")
+            for message in regressions:
+                print("  " + message)
+            return 1
+        print(f"No regressions above {args.threshold:.0%} against {args.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from history_manager import HistoryManager
+
+
+# Default amount of RAM all open documents may use together (2 GB)
+DEFAULT_POOL_BYTES = 2 * 1024 * 1024 * 1024
+
+
+class Document:
+    """
+    Class that holds everything that belongs to one open image: the current image, its undo/redo history, the edit list, the session file and the zoomed view.
+    While a document isn't shown its pixels can be evicted: the images are compressed into the spill file of its history, the history and caches give their RAM back, and everything is reloaded when the document is activated again.
+    """
+
+    def __init__(self, image=None, filepath=None, history=None, edits=None, session=None):
+        self.current_image = image
+        self.filepath = filepath
+        self.history = history or HistoryManager()
+        self.edits = edits
+        self.session = session
+        # (path, info) of the session file that is started on the first edit, so opening an image alone writes nothing
+        self.pending_session = None
+        # View state, see ImageEditorApp
+        self.pyramid = None
+        self.zoom = None
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.evicted = False
+        # (state token, packed entry) of the current image, reused when the document is evicted again without being edited
+        self._packed_current = None
+        # Packed copy of the source image of the edit list, which never changes
+        self._packed_source = None
+        self._source_is_current = False
+
+    @property
+    def title(self):
+        """This property will return the name shown on the document's tab."""
+        return os.path.basename(self.filepath) if self.filepath else "Untitled"
+
+    def nbytes(self):
+        """This method will return the number of bytes the document keeps in RAM: its images, pyramid levels, cached edit results and history."""
+        arrays = [self.current_image]
+        if self.edits is not None:
+            arrays.append(self.edits.source)
+        if self.pyramid is not None:
+            arrays += self.pyramid.levels
+        # The same array is often the current image, the source and pyramid level 0
+        unique = {id(a): a.nbytes for a in arrays if a is not None}
+        total = sum(unique.values()) + self.history.memory_usage()
+        if self.edits is not None:
+            total += self.edits.cache_usage()
+        for entry in self._packed_entries():
+            total += entry.nbytes
+        return total
+
+    def reload_bytes(self):
+        """This method will return how many bytes reloading an evicted document will take."""
+        if not self.evicted:
+            return 0
+        total = 0
+        for entry in self._packed_entries():
+            total += int(np.prod(entry.meta["shape"])) * np.dtype(entry.meta["dtype"]).itemsize
+        return total
+
+    def evict(self):
+        """This method will compress the images of the document into storage and give back the RAM of its images, caches and history."""
+        if self.evicted or self.current_image is None:
+            return
+        token = self.history.current_token
+        if self._packed_current is None or self._packed_current[0] != token:
+            if self._packed_current is not None:
+                self.history.discard_packed(self._packed_current[1])
+            self._packed_current = (token, self.history.pack_image(self.current_image))
+        if self.edits is not None:
+            self._source_is_current = self.edits.source is self.current_image
+            if not self._source_is_current and self._packed_source is None:
+                self._packed_source = self.history.pack_image(self.edits.source)
+            self.edits.source = None
+            self.edits.clear_cache()
+        self.current_image = None
+        self.pyramid = None
+        self.history.release(0)
+        self.evicted = True
+
+    def load(self):
+        """This method will bring the images of an evicted document back into RAM. The history stays on disk until it is undone or redone."""
+        if not self.evicted:
+            return
+        self.current_image = self.history.apply_entry(self._packed_current[1], None)
+        if self.edits is not None:
+            if self._source_is_current:
+                self.edits.source = self.current_image
+            else:
+                self.edits.source = self.history.apply_entry(self._packed_source, None)
+        self.evicted = False
+
+    def trim(self, max_bytes):
+        """This method will drop the cached edit results and spill history until the document uses at most max_bytes, without touching the images that are shown."""
+        if self.edits is not None:
+            self.edits.clear_cache()
+        pixels = self.nbytes() - self.history.memory_usage()
+        self.history.release(max(max_bytes - pixels, 0))
+
+    def _packed_entries(self):
+        """This method will return the packed images of the document."""
+        entries = [] if self._packed_current is None else [self._packed_current[1]]
+        if self._packed_source is not None:
+            entries.append(self._packed_source)
+        return entries
+
+
+class MemoryPool:
+    """
+    Class that keeps the RAM used by all open documents under one cap, no matter how many are open.
+    Documents are kept in least recently used order. When the total goes over the cap the documents that were used longest ago are evicted first, and if the active document alone doesn't fit its caches and history are trimmed.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_POOL_BYTES):
+        self.max_bytes = max_bytes
+        # id(document) -> document, least recently used first
+        self._documents = OrderedDict()
+
+    def add(self, document):
+        """This method will start tracking a document."""
+        self._documents[id(document)] = document
+
+    def remove(self, document):
+        """This method will stop tracking a closed document."""
+        self._documents.pop(id(document), None)
+
+    def usage(self):
+        """This method will return the number of bytes all documents keep in RAM."""
+        return sum(document.nbytes() for document in self._documents.values())
+
+    def activate(self, document):
+        """This method will mark a document as the most recently used one and reload it if it was evicted, making room for it first."""
+        self._documents.move_to_end(id(document))
+        if document.evicted:
+            self.enforce(document, document.reload_bytes())
+            document.load()
+        self.enforce(document)
+
+    def enforce(self, active=None, reserve=0):
+        """This method will evict the least recently used documents, never the active one, until the total plus reserve bytes fits under the cap. If that isn't enough the active document is trimmed."""
+        usage = self.usage()
+        for document in list(self._documents.values()):
+            if usage + reserve <= self.max_bytes:
+                return
+            if document is active or document.evicted:
+                continue
+            usage -= document.nbytes()
+            document.evict()
+            usage += document.nbytes()
+        if usage + reserve > self.max_bytes and active is not None and not active.evicted:
+            active.trim(self.max_bytes - reserve - (usage - active.nbytes()))
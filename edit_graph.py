@@ -0,0 +1,172 @@
+import json
+import threading
+from collections import OrderedDict
+import cv2
+from batch import check_arguments
+from image_processor import EDIT_OPERATIONS, ImageProcessor
+
+
+# Default amount of RAM used to cache intermediate results (512 MB)
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+# Version written into saved edit lists
+EDIT_LIST_VERSION = 1
+
+
+class EditGraph:
+    """
+    Class that keeps edits non-destructive: the source image plus an ordered list of ImageProcessor operations given as (method name, args...) tuples.
+    The result after every step is cached in an LRU keyed by the operations that led to it, so changing or removing a step only recomputes from that step onward. Changes to the list can be undone and redone, and the list can be saved as JSON without any pixels.
+    """
+
+    def __init__(self, source, operations=None, source_path=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.source = source
+        self.source_path = source_path
+        self.operations = [tuple(op) for op in operations or []]
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        # Renders may run on a worker thread while the Tk thread records new steps
+        self._lock = threading.Lock()
+        self._undo_stack = []
+        self._redo_stack = []
+
+    def render(self, operations=None):
+        """This method will return the image after applying the operations (the current list by default), starting from the longest prefix that is still cached."""
+        operations = self.operations if operations is None else [tuple(op) for op in operations]
+        start, image = 0, self.source
+        with self._lock:
+            for n in range(len(operations), 0, -1):
+                cached = self._cache.get(tuple(operations[:n]))
+                if cached is not None:
+                    self._cache.move_to_end(tuple(operations[:n]))
+                    start, image = n, cached
+                    break
+
+        for i in range(start, len(operations)):
+            name, *args = operations[i]
+            image = getattr(ImageProcessor, name)(image, *args)
+            self._store(tuple(operations[:i + 1]), image)
+        return image
+
+    def append(self, operation):
+        """This method will add an operation at the end of the list. Its result isn't cached, because the history already keeps the images of committed edits and the cache would pin them in RAM after the history has compressed them; render caches the prefixes it computes itself."""
+        self._snapshot()
+        self.operations.append(tuple(operation))
+
+    def replace(self, index, operation):
+        """This method will change the operation (or its parameters) at the given step."""
+        self._snapshot()
+        self.operations[index] = tuple(operation)
+
+    def remove(self, index):
+        """This method will delete the operation at the given step."""
+        self._snapshot()
+        del self.operations[index]
+
+    def set_operations(self, operations):
+        """This method will replace the whole operation list, e.g. with a list that was edited and rendered elsewhere."""
+        self._snapshot()
+        self.operations = [tuple(op) for op in operations]
+
+    def undo(self):
+        """This method will go back to the previous operation list. It returns False if there is nothing to undo."""
+        if not self._undo_stack:
+            return False
+        self._redo_stack.append(self.operations)
+        self.operations = self._undo_stack.pop()
+        return True
+
+    def redo(self):
+        """This method will go forward to the next operation list. It returns False if there is nothing to redo."""
+        if not self._redo_stack:
+            return False
+        self._undo_stack.append(self.operations)
+        self.operations = self._redo_stack.pop()
+        return True
+
+    def clear_cache(self):
+        """This method will drop every cached intermediate result, e.g. to give the memory back while the document isn't shown."""
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+
+    def cache_usage(self):
+        """This method will return the number of bytes used by cached intermediate results."""
+        return self._cache_bytes
+
+    def to_dict(self, with_history=False):
+        """This method will return the edit list as a JSON serializable dictionary. With with_history the earlier and later versions of the list are included, so undo and redo keep working after a session is restored."""
+        data = {
+            "version": EDIT_LIST_VERSION,
+            "source": self.source_path,
+            "operations": [list(op) for op in self.operations],
+        }
+        if with_history:
+            data["undo"] = [[list(op) for op in ops] for ops in self._undo_stack]
+            data["redo"] = [[list(op) for op in ops] for ops in self._redo_stack]
+        return data
+
+    @classmethod
+    def from_dict(cls, data, source):
+        """This method will rebuild an edit graph for the given source image from a to_dict dictionary. It raises a ValueError if the dictionary names an operation that isn't an edit or gives it the wrong arguments."""
+        cls.check(data)
+        graph = cls(source, data["operations"], data.get("source"))
+        graph._undo_stack = [[tuple(op) for op in ops] for ops in data.get("undo", [])]
+        graph._redo_stack = [[tuple(op) for op in ops] for ops in data.get("redo", [])]
+        return graph
+
+    def save(self, path):
+        """This method will write the edit list to a JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path, source=None):
+        """This method will read an edit list from a JSON file. The source image is loaded from the path stored in the file unless it is given."""
+        data = cls.read(path)
+        if source is None:
+            source = cv2.imread(data["source"], cv2.IMREAD_ANYCOLOR)
+            if source is None:
+                raise ValueError(f"Could not load source image: {data['source']}")
+        return cls.from_dict(data, source)
+
+    @classmethod
+    def read(cls, path):
+        """This method will read and check an edit list JSON file without loading its source image, and return it as a to_dict dictionary. from_dict turns it into an edit graph once the source is decoded."""
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != EDIT_LIST_VERSION:
+            raise ValueError(f"Unsupported edit list version: {data.get('version')}")
+        if not data.get("source"):
+            raise ValueError("The edit list doesn't name a source image")
+        cls.check(data)
+        return data
+
+    @staticmethod
+    def check(data):
+        """This method will raise a ValueError if a to_dict dictionary (which may come from any file) holds an operation that isn't in EDIT_OPERATIONS or doesn't fit its arguments, in the current list or its undo and redo versions."""
+        for operations in [data["operations"]] + data.get("undo", []) + data.get("redo", []):
+            for name, *args in operations:
+                if name not in EDIT_OPERATIONS:
+                    raise ValueError(f"Unknown operation: {name}")
+                check_arguments(name, name, args)
+
+    def _snapshot(self):
+        """This method will remember the current operation list so the change can be undone."""
+        self._undo_stack.append(list(self.operations))
+        self._redo_stack.clear()
+
+    def _store(self, key, image):
+        """This method will cache an intermediate result and evict the least recently used ones beyond the byte budget."""
+        if image.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None:
+                self._cache_bytes -= previous.nbytes
+            self._cache[key] = image
+            self._cache_bytes += image.nbytes
+            while self._cache_bytes > self.max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
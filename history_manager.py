@@ -1,28 +1,459 @@
+import itertools
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from image_processor import ImageProcessor
+
+
+# Default amount of RAM the undo/redo history is allowed to use (256 MB)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Rows compared, compressed and decompressed at a time, so history updates need little memory on top of the images themselves
+BAND_ROWS = 256
+
+# Dead space the spill file may hold before it is rewritten with only the live entries (64 MB)
+SPILL_COMPACT_BYTES = 64 * 1024 * 1024
+
+# Every image state gets a unique token so views can cache what they have rendered for it
+_state_tokens = itertools.count()
+
+# Reversible operations are stored as the operation that undoes them instead of pixels
+INVERSE_OPERATIONS = {
+    "rotate_image": lambda angle: ("rotate_image", (360 - angle) % 360),
+    "flip_image": lambda mode: ("flip_image", mode),
+}
+
+
+class HistoryEntry:
+    """
+    Class that represents a single undo or redo step.
+    An entry of kind "operation" replays an ImageProcessor method, "patch" holds a compressed XOR delta of the changed region and "full" holds a compressed copy of the whole image.
+    Until a patch or full entry is compressed it keeps the image it rebuilds as it is (and for a patch the image it was diffed against), so undoing a recent step just hands that image back.
+    """
+
+    __slots__ = ("kind", "meta", "data", "spill", "token", "image", "reference", "mapped")
+
+    def __init__(self, kind, meta, data=None, image=None, reference=None, mapped=False):
+        self.kind = kind
+        self.meta = meta
+        self.data = data
+        # Data is a view into a memory-mapped file (like a restored session), so it takes no RAM and is never spilled
+        self.mapped = mapped
+        # (offset, length) inside the spill file once the data has been moved to disk
+        self.spill = None
+        # Token of the image state this entry rebuilds
+        self.token = None
+        # Uncompressed image state and the image of the neighbouring state, dropped once data is set
+        self.image = image
+        self.reference = reference
+
+    @property
+    def nbytes(self):
+        """This property will return the number of bytes this entry keeps in RAM. Mapped data is paged in and out by the OS, so it counts as none."""
+        image = self.image
+        if image is not None:
+            return image.nbytes
+        return len(self.data) if self.data is not None and not self.mapped else 0
+
+
 class HistoryManager:
     """
     Class that handles the Undo & Redo logic using stacks.
+    Instead of full image copies the stacks hold compact HistoryEntry objects, and the total memory they use is kept under a byte budget. Recent steps keep the image they rebuild without copying it, so undo and redo are instant. Once the budget is exceeded the oldest steps are compressed on a background thread and then spilled to a temporary file (or dropped when spilling is disabled).
+    encode does the slow part of recording an edit and doesn't touch the stacks, so it can run on a worker thread while push_entry is left for the Tk thread.
     """
 
-    def __init__(self):
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, spill_to_disk=True, compression_level=1):
         self._undo_stack = []
         self._redo_stack = []
+        self.max_bytes = max_bytes
+        self.spill_to_disk = spill_to_disk
+        self.compression_level = compression_level
+        # Temporary file is only created the first time something has to be spilled
+        self._spill_file = None
+        self._spilled_bytes = 0
+        # Bytes of the spill file that belong to entries which are gone
+        self._dead_bytes = 0
+        # Images compressed with pack_image, they keep the spill file alive like the stacks do
+        self._packed = []
+        # Token of the image state the stacks currently lead away from
+        self.current_token = next(_state_tokens)
+        # (from token, to token, region) of the latest change, see _record_change
+        self.last_change = None
+        # Guards the entries and the spill file against the background compression
+        self._lock = threading.RLock()
+        # Thread compressing the oldest steps is only started when the budget is first exceeded
+        self._compressor = None
+        # id(entry) -> future of entries waiting to be compressed
+        self._compressing = {}
 
-    def push_state(self, image):
-        """This method is used to push the current image state into undo stack and clear the redo stack."""
-        if image is not None:
-            self._undo_stack.append(image.copy())
+    def encode(self, image, result=None, operation=None):
+        """This method will build the entry that rebuilds image from the edited result, given the operation tuple (method name, args...) that made it. Reversible operations become their inverse operation, other edits keep image as it is together with the region that changed. It doesn't touch the stacks, so it can run on a worker thread, and image must not be changed afterwards."""
+        if operation is not None and result is not None and operation[0] in INVERSE_OPERATIONS:
+            inverse = INVERSE_OPERATIONS[operation[0]](*operation[1:])
+            return HistoryEntry("operation", {"operation": inverse, "forward": tuple(operation)})
+
+        if result is not None and result.shape == image.shape and result.dtype == image.dtype:
+            bbox = self._changed_region(image, result)
+            if bbox is None:
+                return HistoryEntry("patch", {"bbox": None})
+            # XOR delta is symmetric, so the same entry is reused for both undo and redo once it is compressed
+            return HistoryEntry("patch", {"bbox": bbox}, image=image, reference=result)
+        return HistoryEntry("full", {"shape": image.shape, "dtype": image.dtype.str}, image=image)
+
+    def push_entry(self, entry):
+        """This method is used to push an entry made by encode into undo stack and clear the redo stack."""
+        with self._lock:
+            entry.token = self.current_token
+            self.current_token = next(_state_tokens)
+            self._record_change(entry.token, entry)
+            self._undo_stack.append(entry)
+            self._drop(self._redo_stack)
             self._redo_stack.clear()
+            self._enforce_budget()
+
+    def push_state(self, image, result=None, operation=None):
+        """This method is used to push the current image state into undo stack and clear the redo stack. If the edited result is given the state is stored as a delta against it, and if the operation tuple (method name, args...) is reversible only the inverse operation is stored."""
+        if image is not None:
+            self.push_entry(self.encode(image, result, operation))
 
     def undo(self, current_image):
         """This method is used to pop the last image state from the undo stack and push the current image state into the redo stack and then return that popped image state to display it on the canvas."""
-        if self._undo_stack:
-            self._redo_stack.append(current_image)
-            return self._undo_stack.pop()
+        with self._lock:
+            if self._undo_stack:
+                entry = self._undo_stack.pop()
+                previous, counterpart = self._restore(entry, current_image)
+                if counterpart is not entry:
+                    self._drop([entry])
+                self._swap_tokens(entry, counterpart)
+                self._redo_stack.append(counterpart)
+                self._enforce_budget()
+                return previous
         return None
 
     def redo(self, current_image):
         """This method is used to pop the last image state from the redo stack and push the current image state into the undo stack and then return that popped image state to display it on the canvas."""
-        if self._redo_stack:
-            self._undo_stack.append(current_image)
-            return self._redo_stack.pop()
+        with self._lock:
+            if self._redo_stack:
+                entry = self._redo_stack.pop()
+                following, counterpart = self._restore(entry, current_image)
+                if counterpart is not entry:
+                    self._drop([entry])
+                self._swap_tokens(entry, counterpart)
+                self._undo_stack.append(counterpart)
+                self._enforce_budget()
+                return following
         return None
+
+    def memory_usage(self):
+        """This method will return the number of bytes the undo and redo stacks currently keep in RAM."""
+        return sum(entry.nbytes for entry in self._undo_stack + self._redo_stack)
+
+    def disk_usage(self):
+        """This method will return the number of bytes the spilled entries that are still in use take in the temporary file."""
+        return self._spilled_bytes
+
+    def flush(self):
+        """This method will wait until the steps being compressed in the background are done, e.g. before measuring memory."""
+        while self._compressing:
+            for future in list(self._compressing.values()):
+                future.result()
+
+    def release(self, max_bytes=0):
+        """This method will compress and spill the oldest entries (or drop them when spilling is disabled) until the history keeps at most max_bytes in RAM, e.g. to give memory back while its document isn't shown. Unlike the normal budget it compresses right away instead of in the background."""
+        self._enforce_budget(min(max_bytes, self.max_bytes), wait=True)
+
+    def pack_image(self, image):
+        """This method will compress an image into a full entry that is kept outside the stacks and moved to the spill file when spilling is enabled. apply_entry(entry, None) gives the image back."""
+        meta = {"shape": image.shape, "dtype": image.dtype.str}
+        entry = HistoryEntry("full", meta, self._compress_data("full", meta, image))
+        with self._lock:
+            self._packed.append(entry)
+            if self.spill_to_disk:
+                self._spill(entry)
+        return entry
+
+    def discard_packed(self, entry):
+        """This method will forget an image compressed with pack_image."""
+        with self._lock:
+            self._packed.remove(entry)
+            self._drop([entry])
+            self._enforce_budget()
+
+    def stacks(self):
+        """This method will return copies of the undo and redo stacks (oldest entry first), e.g. to write them into a session file."""
+        return list(self._undo_stack), list(self._redo_stack)
+
+    def entry_data(self, entry, deferred=False):
+        """This method will return the compressed data of an entry, wherever it is kept. An entry that isn't compressed yet is compressed without changing it, and with deferred a function doing that is returned instead, so the work can happen on another thread."""
+        with self._lock:
+            image, reference = entry.image, entry.reference
+            if image is None:
+                if entry.data is None and entry.spill is None:
+                    # Operations and unchanged patches have no data
+                    return b""
+                return self._read(entry)
+
+        def compress():
+            return self._compress_data(entry.kind, entry.meta, image, reference)
+
+        return compress if deferred else compress()
+
+    def restore_stacks(self, undo_entries, redo_entries):
+        """This method will replace the stacks with entries loaded from elsewhere (like a session file). Every state gets a fresh token so views never mistake them for states of this run."""
+        with self._lock:
+            self._drop(self._undo_stack + self._redo_stack)
+            self._undo_stack = list(undo_entries)
+            self._redo_stack = list(redo_entries)
+            for entry in self._undo_stack + self._redo_stack:
+                entry.token = next(_state_tokens)
+            self.current_token = next(_state_tokens)
+            self.last_change = None
+            self._enforce_budget()
+
+    def apply_entry(self, entry, image, reverse=False):
+        """This method will return the image an entry leads to from the given image, without changing the stacks. With reverse the entry is walked the other way, which works for patches and operations but not for full copies. An entry that isn't compressed yet returns the image it keeps, without a copy."""
+        if entry.kind == "operation":
+            name, *args = entry.meta["forward" if reverse else "operation"]
+            return getattr(ImageProcessor, name)(image, *args)
+        with self._lock:
+            raw, reference = entry.image, entry.reference
+            data = None
+            if raw is None and (entry.kind == "full" or entry.meta["bbox"] is not None):
+                data = self._read(entry)
+        if reverse and entry.kind == "full":
+            raise ValueError("A full history entry can't be walked in reverse")
+        if raw is not None:
+            return reference if reverse else raw
+        if entry.kind == "patch":
+            image = image.copy()
+            if data is not None:
+                y0, y1, x0, x1 = entry.meta["bbox"]
+                self._decompress_into(data, image[y0:y1, x0:x1], xor=True)
+            return image
+        image = np.empty(entry.meta["shape"], dtype=np.dtype(entry.meta["dtype"]))
+        self._decompress_into(data, image)
+        return image
+
+    def _swap_tokens(self, entry, counterpart):
+        """This method will make the token of the restored entry current and give the counterpart the token of the state that was left."""
+        token = entry.token
+        counterpart.token = self.current_token
+        self.current_token = token
+        self._record_change(counterpart.token, entry)
+
+    def _record_change(self, previous_token, entry):
+        """This method will remember which region changed between the previous state and the current one, so views can update only that part. The region is an (y0, y1, x0, x1) box, or None when the whole image may have changed."""
+        region = None
+        if entry.kind == "patch":
+            # An empty box means the two states have the same pixels
+            region = entry.meta["bbox"] or (0, 0, 0, 0)
+        self.last_change = (previous_token, self.current_token, region)
+
+    def _restore(self, entry, current_image):
+        """This method will apply an entry to the current image and return the rebuilt image together with the entry that leads back to the current image."""
+        # Called with the lock held, so the entry can't be compressed in between
+        raw = entry.image
+        image = self.apply_entry(entry, current_image)
+        if entry.kind == "operation":
+            counterpart = HistoryEntry(
+                "operation", {"operation": entry.meta["forward"], "forward": entry.meta["operation"]})
+        elif entry.kind == "patch" and raw is not None:
+            counterpart = HistoryEntry("patch", entry.meta, image=current_image, reference=image)
+        elif entry.kind == "patch":
+            # XOR patches are their own inverse
+            counterpart = entry
+        else:
+            counterpart = HistoryEntry("full", {"shape": current_image.shape, "dtype": current_image.dtype.str},
+                                       image=current_image)
+        return image, counterpart
+
+    def _compress_data(self, kind, meta, image, reference=None):
+        """This method will compress the XOR delta of a patch (or the whole image of a full entry) band by band, so no full size temporary copy is made."""
+        compressor = zlib.compressobj(self.compression_level)
+        # Appending to a bytearray avoids joining a list of chunks into a second copy
+        data = bytearray()
+        if kind == "patch":
+            y0, y1, x0, x1 = meta["bbox"]
+            for y in range(y0, y1, BAND_ROWS):
+                band = slice(y, min(y + BAND_ROWS, y1))
+                data += compressor.compress(np.bitwise_xor(image[band, x0:x1], reference[band, x0:x1]).data)
+        else:
+            for y in range(0, image.shape[0], BAND_ROWS):
+                data += compressor.compress(np.ascontiguousarray(image[y:y + BAND_ROWS]).data)
+        data += compressor.flush()
+        return data
+
+    def _compress(self, entry):
+        """This method will replace the images an entry keeps with their compressed data."""
+        with self._lock:
+            image, reference = entry.image, entry.reference
+        if image is None:
+            return
+        data = self._compress_data(entry.kind, entry.meta, image, reference)
+        with self._lock:
+            # Data is set before the images are dropped, so readers always find one of them
+            if entry.image is image:
+                entry.data = data
+                entry.image = None
+                entry.reference = None
+
+    def _compress_later(self, entry):
+        """This method will queue an entry for compression on the background thread."""
+        if id(entry) in self._compressing:
+            return
+        if self._compressor is None:
+            self._compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+        self._compressing[id(entry)] = self._compressor.submit(self._compress_in_background, entry)
+
+    def _compress_in_background(self, entry):
+        """This method runs on the background thread, compresses an entry and checks the budget again."""
+        try:
+            self._compress(entry)
+        finally:
+            with self._lock:
+                self._compressing.pop(id(entry), None)
+                self._enforce_budget()
+
+    @staticmethod
+    def _changed_region(a, b):
+        """This method will return the bounding box (y0, y1, x0, x1) of the pixels that differ between two images of the same shape, or None if they are identical."""
+        changed_rows = []
+        changed_cols = np.zeros(a.shape[1], dtype=bool)
+        for y in range(0, a.shape[0], BAND_ROWS):
+            diff = a[y:y + BAND_ROWS] != b[y:y + BAND_ROWS]
+            if diff.ndim == 3:
+                diff = diff.any(axis=2)
+            changed_rows.append(y + np.flatnonzero(diff.any(axis=1)))
+            changed_cols |= diff.any(axis=0)
+        rows = np.concatenate(changed_rows)
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(changed_cols)
+        return int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+
+    @staticmethod
+    def _decompress_into(data, out, xor=False):
+        """This method will decompress data band by band straight into out (or XOR it into out), so no full size temporary copy is made."""
+        decompressor = zlib.decompressobj()
+        pending = data
+        for y in range(0, out.shape[0], BAND_ROWS):
+            band = out[y:y + BAND_ROWS]
+            chunk = decompressor.decompress(pending, band.nbytes)
+            pending = decompressor.unconsumed_tail
+            while len(chunk) < band.nbytes:
+                chunk += decompressor.decompress(pending, band.nbytes - len(chunk))
+                pending = decompressor.unconsumed_tail
+            values = np.frombuffer(chunk, dtype=out.dtype).reshape(band.shape)
+            if xor:
+                np.bitwise_xor(band, values, out=band)
+            else:
+                band[...] = values
+
+    def _read(self, entry):
+        """This method will return the compressed data of an entry, reading it back from the spill file if needed."""
+        with self._lock:
+            if entry.data is not None:
+                return entry.data
+            offset, length = entry.spill
+            self._spill_file.seek(offset)
+            return self._spill_file.read(length)
+
+    def _enforce_budget(self, max_bytes=None, wait=False):
+        """This method will bring the RAM used by the history under max_bytes (the budget of the history by default). The oldest uncompressed steps are compressed first, on the background thread unless wait is set, and compressed steps are then spilled or dropped."""
+        with self._lock:
+            limit = self.max_bytes if max_bytes is None else max_bytes
+            if not self._undo_stack and not self._redo_stack and not self._packed and self._spill_file is not None:
+                # Nothing references the spill file anymore so its space can be reclaimed
+                self._spill_file.close()
+                self._spill_file = None
+                self._spilled_bytes = 0
+                self._dead_bytes = 0
+            elif self._dead_bytes > max(self._spilled_bytes, SPILL_COMPACT_BYTES):
+                self._compact_spill()
+
+            usage = self.memory_usage()
+            if usage <= limit:
+                return
+
+            # Oldest undo steps go first, then the redo steps that are furthest away
+            order = self._undo_stack + self._redo_stack[::-1]
+            pending = False
+            for entry in order:
+                if usage <= limit:
+                    break
+                if entry.image is not None:
+                    usage -= entry.nbytes
+                    if wait:
+                        self._compress(entry)
+                        usage += entry.nbytes
+                    else:
+                        self._compress_later(entry)
+                        pending = True
+            if pending:
+                # Spilling waits until the compressed sizes are known, the background thread checks again when it is done
+                return
+
+            usage = self.memory_usage()
+            if usage <= limit:
+                return
+
+            if not self.spill_to_disk:
+                # Entries only make sense relative to their newer neighbour, so they are dropped from the far ends of the stacks
+                dropped = []
+                while usage > limit and self._undo_stack:
+                    dropped.append(self._undo_stack.pop(0))
+                    usage -= dropped[-1].nbytes
+                while usage > limit and self._redo_stack:
+                    dropped.append(self._redo_stack.pop(0))
+                    usage -= dropped[-1].nbytes
+                self._drop(dropped)
+                return
+
+            for entry in order:
+                if usage <= limit:
+                    break
+                if entry.image is None and entry.data is not None and not entry.mapped:
+                    usage -= entry.nbytes
+                    self._spill(entry)
+
+    def _spill(self, entry):
+        """This method will move the data of an entry from RAM into the temporary spill file."""
+        with self._lock:
+            if entry.mapped:
+                # Already on disk in the mapped file
+                return
+            if self._spill_file is None:
+                self._spill_file = tempfile.TemporaryFile(prefix="history_")
+            self._spill_file.seek(0, 2)
+            offset = self._spill_file.tell()
+            self._spill_file.write(entry.data)
+            entry.spill = (offset, len(entry.data))
+            self._spilled_bytes += len(entry.data)
+            entry.data = None
+
+    def _drop(self, entries):
+        """This method will account for entries that are gone: the space their data takes in the spill file becomes dead and is reclaimed by _compact_spill."""
+        with self._lock:
+            for entry in entries:
+                if entry.spill is not None:
+                    self._spilled_bytes -= entry.spill[1]
+                    self._dead_bytes += entry.spill[1]
+                    entry.spill = None
+
+    def _compact_spill(self):
+        """This method will copy the data of the spilled entries that are still in use into a new spill file and close the old one, so the disk space of dropped entries is given back."""
+        with self._lock:
+            old = self._spill_file
+            self._spill_file = tempfile.TemporaryFile(prefix="history_")
+            for entry in self._undo_stack + self._redo_stack + self._packed:
+                if entry.spill is None:
+                    continue
+                offset, length = entry.spill
+                old.seek(offset)
+                entry.spill = (self._spill_file.tell(), length)
+                self._spill_file.write(old.read(length))
+            old.close()
+            self._dead_bytes = 0
@@ -1,34 +1,127 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
+from collections import OrderedDict
+from tkinter import filedialog, messagebox, simpledialog, ttk
 import cv2
 from PIL import Image, ImageTk
 import os
+import time
 from image_processor import ImageProcessor
-from history_manager import HistoryManager
+from task_runner import TaskRunner
+from profiler import Profiler
+from edit_graph import EditGraph
+from image_pyramid import ImagePyramid
+from resizer import RESIZE_MODES, Resizer, resize
+from document import Document, MemoryPool
+from session_store import SessionStore, prune_sessions, session_path, source_stamp
+from batch import parse_operations, write_params
+
+
+# Number of rendered display frames kept for undo/redo
+DISPLAY_CACHE_SIZE = 32
+
+# Quick reduced decodes shown while large files load: (file size above which it is used, decode flag)
+REDUCED_DECODES = [
+    (32 * 1024 * 1024, cv2.IMREAD_REDUCED_COLOR_8),
+    (8 * 1024 * 1024, cv2.IMREAD_REDUCED_COLOR_4),
+    (2 * 1024 * 1024, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+# Only JPEG decodes at a reduced scale natively, other formats are decoded in full and then shrunk, which is no faster
+REDUCED_DECODE_EXTENSIONS = (".jpg", ".jpeg")
+
+# Interval between live preview renders while a slider is dragged (~60 fps)
+PREVIEW_FRAME_MS = 16
+
+# Largest zoom (display pixels per image pixel) and the factor of one mouse wheel step
+MAX_ZOOM = 32
+ZOOM_STEP = 1.25
+
+# Extra pixels filtered around the visible region for a zoomed live preview, so the blur is right at the view edges
+PREVIEW_MARGIN = 16
+
+
+def format_bytes(size):
+    """This function will format a number of bytes as a human readable string like "12.3 MB"."""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def _document_attribute(name):
+    """This function will create a property that reads and writes an attribute of the active document, so the editor code works on whichever document is shown."""
+    return property(lambda self: getattr(self.document, name),
+                    lambda self, value: setattr(self.document, name, value))
 
 
 class ImageEditorApp:
     """
     Main Application Class using Tkinter.
     This class will create the main window, setup the UI components, handle user interaction, and coordinate with the ImageProcessor and HistoryManager classes to perform image editing operations and manage undo/redo functionality.
+    Every open image is a Document shown in its own tab. The image, history, edit list, session and view attributes below belong to the active document, and all documents share one MemoryPool.
     """
 
+    current_image = _document_attribute("current_image")
+    filepath = _document_attribute("filepath")
+    history = _document_attribute("history")
+    edits = _document_attribute("edits")
+    session = _document_attribute("session")
+    pyramid = _document_attribute("pyramid")
+    zoom = _document_attribute("zoom")
+    view_x = _document_attribute("view_x")
+    view_y = _document_attribute("view_y")
+
     def __init__(self, root):
         self.root = root
         self.root.title("HIT137 Group Assignment 3 - Image Editor")
         self.root.geometry("1100x700")
 
-        # Creating instances of HistoryManager inside ImageEditorApp class
         self.processor = ImageProcessor()
-        self.history = HistoryManager()
+        # Open documents in tab order, the active one and an empty one while nothing is open
+        self.documents = []
+        self.document = Document()
+        # Keeps all documents together under one memory cap
+        self.pool = MemoryPool()
+        # Runs the filters on a worker thread so the window stays responsive
+        self.tasks = TaskRunner(self.root)
+        # (supersede key, start function) of edits waiting for the running filter, see queue_filter
+        self.filter_queue = []
+        # Times every stage of the filter, display and undo/redo paths
+        self.profiler = Profiler()
 
         # State Variables
-        self.current_image = None
-        self.filepath = None
+        self.refresh_steps = None
+        # Encoder settings used by save
+        self.jpeg_quality = 95
+        self.png_compression = 3
+        # Message of the background job shown next to the busy spinner
+        self.busy_message = None
+        # Display sized copies of recent images keyed by history state token, for the live slider preview
+        self.resizer = Resizer()
+        # Display sized copy of current_image used for the live slider preview
+        self.preview_proxy = None
+        self.preview_source = None
+        self.preview_scale = 1.0
+        self.preview_kind = None
+        self.preview_job = None
+        # Rendered frames keyed by (history state token, canvas size)
+        self.display_cache = OrderedDict()
+        self.photo = None
+        self.canvas_item = None
+        self.resize_job = None
+        # Every document keeps a multi-resolution copy of its image the view is drawn from (pyramid), its zoom
+        # (display pixels per image pixel, or None to fit the whole image into the canvas) and the image coordinates
+        # shown in the top left corner of the canvas while zoomed (view_x, view_y)
+        self.pan_anchor = None
+        self.view_job = None
+        # Every document has a session file its history is saved into, so it can be restored after closing or a crash
+        prune_sessions()
 
         # Setup UI Components
         self._setup_menu()
         self._setup_layout()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def _setup_menu(self):
         """Initializes the Menu Bar with File and Edit options."""
@@ -39,16 +132,38 @@ class ImageEditorApp:
         file_menu.add_command(label="Open", command=self.open_image)
         file_menu.add_command(label="Save", command=self.save_image)
         file_menu.add_command(label="Save As", command=self.save_image_as)
+        file_menu.add_command(label="Save Options...", command=self.save_options)
+        file_menu.add_command(label="Memory Limit...", command=self.memory_limit)
+        file_menu.add_command(label="Close", command=self.close_document)
+        file_menu.add_separator()
+        file_menu.add_command(label="Open Edit List...", command=self.open_edit_list)
+        file_menu.add_command(label="Save Edit List...", command=self.save_edit_list)
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.root.quit)
+        file_menu.add_command(label="Exit", command=self.on_close)
         menubar.add_cascade(label="File", menu=file_menu)
 
         # Edit Menu
         edit_menu = tk.Menu(menubar, tearoff=0)
         edit_menu.add_command(label="Undo", command=self.undo_action)
         edit_menu.add_command(label="Redo", command=self.redo_action)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Edit Steps...", command=self.show_edit_steps)
         menubar.add_cascade(label="Edit", menu=edit_menu)
 
+        # View Menu
+        view_menu = tk.Menu(menubar, tearoff=0)
+        view_menu.add_command(label="Zoom In", command=lambda: self.zoom_by(ZOOM_STEP))
+        view_menu.add_command(label="Zoom Out", command=lambda: self.zoom_by(1 / ZOOM_STEP))
+        view_menu.add_command(label="Actual Size", command=self.actual_size)
+        view_menu.add_command(label="Fit to Window", command=self.fit_view)
+        view_menu.add_separator()
+        self.show_timings = tk.BooleanVar(value=False)
+        view_menu.add_checkbutton(label="Show Timings", variable=self.show_timings,
+                                  command=self.toggle_timings)
+        view_menu.add_command(label="Export Trace...", command=self.export_trace)
+        view_menu.add_command(label="Reset Timings", command=self.reset_timings)
+        menubar.add_cascade(label="View", menu=view_menu)
+
         self.root.config(menu=menubar)
 
     def _setup_layout(self):
@@ -101,7 +216,8 @@ class ImageEditorApp:
         tk.Label(self.controls_frame, text="Blur Intensity",
                  bg="#f0f0f0", foreground="#000000").pack(pady=(10, 0))
         self.blur_scale = tk.Scale(
-            self.controls_frame, from_=0, to=20, orient=tk.HORIZONTAL, bg="#f0f0f0")
+            self.controls_frame, from_=0, to=20, orient=tk.HORIZONTAL, bg="#f0f0f0",
+            command=lambda _: self.schedule_preview("blur"))
         self.blur_scale.pack(fill=tk.X)
         tk.Button(self.controls_frame, text="Apply Blur",
                   command=self.apply_blur).pack(pady=2)
@@ -110,7 +226,8 @@ class ImageEditorApp:
         tk.Label(self.controls_frame, text="Brightness",
                  bg="#f0f0f0", foreground="#000000").pack(pady=(10, 0))
         self.bright_scale = tk.Scale(
-            self.controls_frame, from_=-100, to=100, orient=tk.HORIZONTAL, bg="#f0f0f0")
+            self.controls_frame, from_=-100, to=100, orient=tk.HORIZONTAL, bg="#f0f0f0",
+            command=lambda _: self.schedule_preview("brightness"))
         self.bright_scale.pack(fill=tk.X)
         tk.Button(self.controls_frame, text="Apply Brightness",
                   command=self.apply_brightness).pack(pady=2)
@@ -119,7 +236,8 @@ class ImageEditorApp:
         tk.Label(self.controls_frame, text="Contrast",
                  bg="#f0f0f0", foreground="#000000").pack(pady=(10, 0))
         self.contrast_scale = tk.Scale(
-            self.controls_frame, from_=0.5, to=3.0, resolution=0.1, orient=tk.HORIZONTAL, bg="#f0f0f0")
+            self.controls_frame, from_=0.5, to=3.0, resolution=0.1, orient=tk.HORIZONTAL, bg="#f0f0f0",
+            command=lambda _: self.schedule_preview("contrast"))
         self.contrast_scale.set(1.0)
         self.contrast_scale.pack(fill=tk.X)
         tk.Button(self.controls_frame, text="Apply Contrast",
@@ -133,9 +251,23 @@ class ImageEditorApp:
         self.display_frame = tk.Frame(container, bg="#333")
         self.display_frame.pack(side=tk.BOTTOM, fill=tk.BOTH, expand=True)
 
+        # One tab per open document, right above the image
+        self.notebook = ttk.Notebook(container)
+        self.notebook.pack(side=tk.BOTTOM, fill=tk.X)
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        self.tab_frames = []
+
         self.canvas = tk.Canvas(
             self.display_frame, bg="#333", highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        # Mouse wheel zooms around the pointer (Button-4/5 on Linux), dragging pans and a double click fits the image again
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-5>", self.on_mouse_wheel)
+        self.canvas.bind("<ButtonPress-1>", self.start_pan)
+        self.canvas.bind("<B1-Motion>", self.on_pan)
+        self.canvas.bind("<Double-Button-1>", lambda _: self.fit_view())
 
         # 3. Status Bar
         """Sets up the Status Bar at the top."""
@@ -145,23 +277,228 @@ class ImageEditorApp:
             container, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(side=tk.TOP, fill=tk.X)
 
+        # 4. Timings Panel, hidden until enabled from the View menu
+        self.timings_var = tk.StringVar()
+        self.timings_panel = tk.Label(
+            container, textvariable=self.timings_var, font=("Courier", 9), justify=tk.LEFT, anchor=tk.W)
+
+    @staticmethod
+    def read_image(file_path, flags=cv2.IMREAD_ANYCOLOR):
+        """This method runs on a worker thread and decodes an image file, returning the image, the file size and the time it took. Grayscale files are kept single-channel, everything else is decoded as BGR."""
+        start = time.perf_counter()
+        img = cv2.imread(file_path, flags)
+        if img is None:
+            raise ValueError("Could not load image.")
+        return img, os.path.getsize(file_path), time.perf_counter() - start
+
+    @staticmethod
+    def write_image(file_path, image, params):
+        """This method runs on a worker thread and encodes the image into a file, returning the file size and the time it took."""
+        start = time.perf_counter()
+        if not cv2.imwrite(file_path, image, params):
+            raise ValueError("Could not save image.")
+        return os.path.getsize(file_path), time.perf_counter() - start
+
     def open_image(self):
-        """This method opens a file dialog to select an image, loads it using OpenCV, and displays it on the canvas. It also resets the history and updates the status bar."""
+        """This method opens a file dialog to select an image and decodes it on a worker thread. For large files a reduced resolution decode is shown first and swapped for the full image when it arrives. It also resets the history and updates the status bar."""
         file_path = filedialog.askopenfilename(
-            filetypes=[("Image Files", "*.jpg *.jpeg *.png *.bmp")])
-        if file_path:
-            self.filepath = file_path
-            # Read image using OpenCV
-            img = cv2.imread(file_path)
-            if img is None:
-                messagebox.showerror("Error", "Could not load image.")
+            filetypes=[("Image Files", "*.jpg *.jpeg *.png *.bmp *.tif *.tiff *.webp")])
+        if not file_path:
+            return
+        name = os.path.basename(file_path)
+        for document in self.documents:
+            if document.filepath == file_path:
+                # Already open, show its tab instead of loading it twice
+                self.activate_document(document)
                 return
+        if self.offer_session(file_path):
+            return
 
-            self.current_image = img
-            # Clear history when loading new image
-            self.history = HistoryManager()
+        # The bigger the file, the smaller the quick first decode
+        size = os.path.getsize(file_path)
+        reduced = None
+        for limit, flag in REDUCED_DECODES:
+            if size > limit and file_path.lower().endswith(REDUCED_DECODE_EXTENSIONS):
+                reduced = flag
+                break
+        if reduced is not None:
+            def on_preview(loaded):
+                self.display_image(loaded[0])
+                self.busy_message = f"Loading {name} (showing preview)"
+
+            self.tasks.submit(self.read_image, file_path, reduced,
+                              on_done=on_preview, on_error=lambda e: None, channel="load_preview")
+
+        def on_done(loaded):
+            img, nbytes, elapsed = loaded
+            # The full image is here, a preview still decoding is no longer needed
+            self.tasks.cancel("load_preview")
+            self.cancel_filters()
+            # The image opens in a new tab with its own history, the other documents stay as they are
+            self.add_document(Document(img, file_path, edits=EditGraph(img, source_path=file_path)))
+            self.start_session(file_path)
+            self.display_image()
+            self.update_status(f"Loaded: {name} ({format_bytes(nbytes)} in {elapsed:.2f} s)")
+
+        def on_error(error):
+            self.tasks.cancel("load_preview")
+            self.display_image()
+            self.task_failed(error)
+
+        self.tasks.submit(self.read_image, file_path, on_done=on_done, on_error=on_error, channel="load")
+        self.show_busy(f"Loading {name}")
+
+    # Sessions
+    def offer_session(self, file_path):
+        """This method will look for a saved session of the image file and, if the file hasn't changed since, ask whether to restore it. It returns True if the session was restored, in which case the file doesn't need to be decoded."""
+        path = session_path(file_path)
+        found = SessionStore.peek(path)
+        if found is None or found["start"] is None or found["start"].get("stamp") != source_stamp(file_path):
+            return False
+        if not found["undo"] and not found["redo"]:
+            return False
+        name = os.path.basename(file_path)
+        if not messagebox.askyesno("Restore Session",
+                                   f"{name} has an unfinished session with {found['undo']} undo and "
+                                   f"{found['redo']} redo steps. Restore it?"):
+            return False
+
+        start = time.perf_counter()
+        try:
+            with self.profiler.stage("session.restore"):
+                store, history, image, original, info = SessionStore.restore(path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"Could not restore session: {e}")
+            return False
+        try:
+            if "edits" in info:
+                edits = EditGraph.from_dict(info["edits"], original)
+            else:
+                edits = EditGraph(original, source_path=file_path)
+        except (ValueError, KeyError) as e:
+            # The edit list would name operations the editor doesn't run
+            store.close()
+            messagebox.showerror("Error", f"Could not restore session: {e}")
+            return False
+        self.add_document(Document(image, file_path, history, edits, store))
+        self.display_image()
+        elapsed = time.perf_counter() - start
+        self.update_status(f"Restored session: {name} ({found['undo']} undo steps in {elapsed * 1000:.0f} ms)")
+        return True
+
+    def start_session(self, file_path):
+        """This method will prepare a new session for a freshly loaded image, replacing any earlier session of the same file. The file itself is only written once the image is edited (see save_session)."""
+        self.close_session()
+        path = session_path(file_path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        try:
+            self.document.pending_session = (path, {"stamp": source_stamp(file_path)})
+        except OSError:
+            # The editor works the same without a session, there is just nothing to restore later
+            self.document.pending_session = None
+
+    def save_session(self):
+        """This method will queue the current history and edit list into the session file, starting the file on the first edit. The writing happens on the session's own thread."""
+        if self.session is None and self.document.pending_session is not None:
+            path, info = self.document.pending_session
+            self.document.pending_session = None
+            undo, _ = self.history.stacks()
+            # The original image is the source of the edit list and the state the oldest undo step rebuilds
+            token = undo[0].token if undo else self.history.current_token
+            try:
+                self.session = SessionStore.create(path, self.edits.source, token, info)
+            except OSError:
+                self.session = None
+        if self.session is None:
+            return
+        if self.session.error is not None:
+            messagebox.showwarning("Warning", f"The session can no longer be saved: {self.session.error}")
+            self.close_session()
+            return
+        with self.profiler.stage("session.record"):
+            self.session.record(self.history, self.current_image,
+                                {"edits": self.edits.to_dict(with_history=True)})
+
+    def close_session(self, document=None):
+        """This method will finish writing the session file of a document (the active one by default) and close it. A session left without any undo or redo steps has nothing to restore, so its file is deleted."""
+        document = document or self.document
+        document.pending_session = None
+        if document.session is None:
+            return
+        document.session.close()
+        undo, redo = document.history.stacks()
+        if not undo and not redo and document.session.error is None:
+            try:
+                os.remove(document.session.path)
+            except OSError:
+                pass
+        document.session = None
+
+    def on_close(self):
+        """This method will close the window once the session files of all documents are fully written."""
+        for document in self.documents:
+            self.close_session(document)
+        self.tasks.shutdown()
+        self.root.destroy()
+
+    # Documents
+    def add_document(self, document):
+        """This method will add a document in a new tab and switch to it."""
+        frame = ttk.Frame(self.notebook, height=1)
+        self.documents.append(document)
+        self.tab_frames.append(frame)
+        self.pool.add(document)
+        self.notebook.add(frame, text=document.title)
+        self.activate_document(document)
+
+    def activate_document(self, document):
+        """This method will make a document the one that is shown and edited. An evicted document is reloaded first, and other documents may be evicted to keep the memory under the cap."""
+        if document is not self.document:
+            # A filter still running belongs to the document we are leaving
+            self.cancel_filters()
+            self.document = document
+            with self.profiler.stage("document.activate", evicted=document.evicted):
+                self.pool.activate(document)
             self.display_image()
-            self.update_status(f"Loaded: {os.path.basename(file_path)}")
+            self.update_status(f"Switched to {document.title}")
+        self.notebook.select(self.tab_frames[self.documents.index(document)])
+
+    def on_tab_changed(self, event):
+        """This method is called when a tab is selected and switches to its document."""
+        if self.documents:
+            self.activate_document(self.documents[self.notebook.index("current")])
+
+    def close_document(self):
+        """This method will close the active document, finishing its session file, and switch to the tab next to it."""
+        if self.document not in self.documents:
+            return
+        self.cancel_filters()
+        self.close_session()
+        i = self.documents.index(self.document)
+        self.pool.remove(self.document)
+        del self.documents[i]
+        self.notebook.forget(self.tab_frames.pop(i))
+        if self.documents:
+            self.activate_document(self.documents[min(i, len(self.documents) - 1)])
+        else:
+            self.document = Document()
+            self.canvas.delete("all")
+            self.canvas_item = None
+            self.photo = None
+            self.status_var.set("Open an image to start editing.")
+
+    def memory_limit(self):
+        """This method will ask for the amount of RAM all open documents may use together and evict documents right away if they use more."""
+        limit = simpledialog.askinteger("Memory Limit", "RAM for all open images (MB):",
+                                        initialvalue=self.pool.max_bytes // (1024 * 1024), minvalue=64)
+        if limit is None:
+            return
+        self.pool.max_bytes = limit * 1024 * 1024
+        self.pool.enforce(self.document)
+        self.update_status(f"Memory limit set to {format_bytes(self.pool.max_bytes)}")
 
     def save_image(self):
         """This method will save the image"""
@@ -169,8 +506,7 @@ class ImageEditorApp:
             messagebox.showwarning("Warning", "No image to save.")
             return
         if self.filepath:
-            cv2.imwrite(self.filepath, self.current_image)
-            messagebox.showinfo("Success", "Image saved successfully.")
+            self.save_to(self.filepath)
         else:
             self.save_image_as()
 
@@ -182,171 +518,671 @@ class ImageEditorApp:
         file_path = filedialog.asksaveasfilename(defaultextension=".jpg",
                                                  filetypes=[("JPEG", "*.jpg"), ("PNG", "*.png"), ("BMP", "*.bmp")])
         if file_path:
-            cv2.imwrite(file_path, self.current_image)
-            self.filepath = file_path
+            self.save_to(file_path)
+
+    def save_to(self, file_path):
+        """This method will encode the current image on a worker thread using the JPEG quality and PNG compression from the save options."""
+        name = os.path.basename(file_path)
+        params = write_params(os.path.splitext(file_path)[1].lower(), self.jpeg_quality, self.png_compression)
+        # Another tab may be active by the time the file is written
+        document = self.document
+
+        def on_done(saved):
+            nbytes, elapsed = saved
+            document.filepath = file_path
+            self.update_status(f"Saved: {name} ({format_bytes(nbytes)} in {elapsed:.2f} s)")
             messagebox.showinfo("Success", "Image saved successfully.")
 
-    # Display Logic
-    def display_image(self):
-        """This method will display the current image on the canvas."""
-        if self.current_image is None:
+        self.tasks.submit(self.write_image, file_path, self.current_image, params,
+                          on_done=on_done, on_error=self.task_failed, channel="save")
+        self.show_busy(f"Saving {name}")
+
+    def save_options(self):
+        """This method will ask for the JPEG quality and PNG compression level used when saving."""
+        quality = simpledialog.askinteger("Save Options", "JPEG quality (0-100):",
+                                          initialvalue=self.jpeg_quality, minvalue=0, maxvalue=100)
+        if quality is None:
             return
+        compression = simpledialog.askinteger("Save Options", "PNG compression level (0-9):",
+                                              initialvalue=self.png_compression, minvalue=0, maxvalue=9)
+        if compression is None:
+            return
+        self.jpeg_quality = quality
+        self.png_compression = compression
 
-        # Convert BGR from OpenCV to RGB Tkinter
-        img_rgb = cv2.cvtColor(self.current_image, cv2.COLOR_BGR2RGB)
+    # Display Logic
+    def canvas_size(self):
+        """This method will return the current size of the canvas, with a default while it isn't drawn yet."""
+        canvas_w = self.canvas.winfo_width()
+        canvas_h = self.canvas.winfo_height()
+        # Default size if canvas isn't drawn yet
+        if canvas_w <= 1:
+            canvas_w = 800
+        if canvas_h <= 1:
+            canvas_h = 600
+        return canvas_w, canvas_h
 
-        # Resize for display if too large to maintain aspect ratio
-        h, w = img_rgb.shape[:2]
-        display_w, display_h = 800, 600
+    def display_size(self, w, h):
+        """This method will return the size an image of w x h pixels is shown at, shrinking it to fit the canvas while keeping the aspect ratio."""
+        display_w, display_h = self.canvas_size()
 
         if w > display_w or h > display_h:
             ratio = min(display_w/w, display_h/h)
-            new_w = int(w * ratio)
-            new_h = int(h * ratio)
-            img_rgb = cv2.resize(img_rgb, (new_w, new_h))
+            return max(1, int(w * ratio)), max(1, int(h * ratio))
+        return w, h
 
-        img_pil = Image.fromarray(img_rgb)
-        img_tk = ImageTk.PhotoImage(img_pil)
+    def render_frame(self, image, size=None):
+        """This method will shrink an image to fit the canvas (or to the given size) and convert it into an RGB PIL image."""
+        # Resize for display if too large to maintain aspect ratio
+        h, w = image.shape[:2]
+        new_w, new_h = size or self.display_size(w, h)
+        if (new_w, new_h) != (w, h):
+            with self.profiler.stage("display.resize"):
+                # Reductions are area filtered (after pyrDown steps when large) so they don't alias, and resizing first means only the small frame gets converted
+                image = resize(image, new_w, new_h)
+        return self.to_pil(image)
 
-        # Update Canvas
-        self.canvas.delete("all")
-        # Center the image
-        canvas_w = self.canvas.winfo_width()
-        canvas_h = self.canvas.winfo_height()
-        # Default center if canvas isn't drawn yet
-        if canvas_w < 1:
-            canvas_w = 800
-        if canvas_h < 1:
-            canvas_h = 600
+    def to_pil(self, image):
+        """This method will convert a BGR (or single-channel gray) frame from OpenCV into an RGB PIL image for Tkinter. Only display sized frames are expanded to 3 channels."""
+        with self.profiler.stage("display.convert"):
+            code = cv2.COLOR_GRAY2RGB if image.ndim == 2 else cv2.COLOR_BGR2RGB
+            return Image.fromarray(cv2.cvtColor(image, code))
+
+    def sync_pyramid(self):
+        """This method will return the pyramid of the current image. When the current image is one history step away from the image the pyramid was built for, only the region that changed is recomputed."""
+        pyramid = self.pyramid
+        if pyramid is not None and pyramid.image is self.current_image:
+            return pyramid
+        token = self.history.current_token
+        change = self.history.last_change
+        if pyramid is not None and change is not None and change[:2] == (pyramid.token, token):
+            with self.profiler.stage("display.pyramid"):
+                pyramid.update(self.current_image, token, change[2])
+        else:
+            # Levels are built lazily, so starting over only costs what the next frame needs
+            self.pyramid = ImagePyramid(self.current_image, token)
+        return self.pyramid
+
+    def display_image(self, image=None):
+        """This method will display the current image (or the given preview image) on the canvas. Frames of the current image are cached per history state and canvas size, so undo and redo to a state that was already shown doesn't render it again."""
+        if image is None:
+            image = self.current_image
+            # Zoomed views change with every pan, so only the fitted view is cached
+            key = (self.history.current_token, self.canvas_size()) if self.zoom is None else None
+        else:
+            key = None
+        if image is None:
+            return
+
+        with self.profiler.stage("display.total", cached=key in self.display_cache):
+            if image is self.current_image and self.zoom is not None:
+                self._show_view()
+            else:
+                self._show(image, key)
+
+    def _show(self, image, key):
+        """This method will get the frame for an image from the cache (or render it) and put it in the middle of the canvas."""
+        img_pil = self.display_cache.get(key) if key else None
+        if img_pil is None:
+            if key:
+                # Shrinking the smallest pyramid level that is still big enough is much cheaper than shrinking the full image
+                h, w = image.shape[:2]
+                size = self.display_size(w, h)
+                pyramid = self.sync_pyramid()
+                img_pil = self.render_frame(pyramid.level(pyramid.level_for_scale(size[0] / w)), size)
+            else:
+                img_pil = self.render_frame(image)
+            if key:
+                self.display_cache[key] = img_pil
+                while len(self.display_cache) > DISPLAY_CACHE_SIZE:
+                    self.display_cache.popitem(last=False)
+        else:
+            self.display_cache.move_to_end(key)
+
+        # Center the image on the canvas
+        canvas_w, canvas_h = self.canvas_size()
+        self._put(img_pil, canvas_w//2, canvas_h//2, tk.CENTER)
+
+    def _show_view(self, func=None, margin=0):
+        """This method will draw the visible part of the zoomed current image. Only the region inside the canvas is cropped from the best pyramid level, filtered with func if it is given (see ImagePyramid.render), resized and converted."""
+        canvas_w, canvas_h = self.canvas_size()
+        with self.profiler.stage("display.viewport", zoom=self.zoom):
+            frame, position = self.sync_pyramid().render(
+                self.view_x, self.view_y, self.zoom, canvas_w, canvas_h, func, margin)
+        if frame is not None:
+            self._put(self.to_pil(frame), *position, tk.NW)
+
+    def _put(self, img_pil, x, y, anchor):
+        """This method will show a frame on the canvas at the given position."""
+        # Reuse the existing PhotoImage when the frame has the same size
+        with self.profiler.stage("display.photo"):
+            if self.photo is not None and (self.photo.width(), self.photo.height()) == img_pil.size:
+                self.photo.paste(img_pil)
+            else:
+                self.photo = ImageTk.PhotoImage(img_pil)
+
+        if self.canvas_item is None:
+            self.canvas_item = self.canvas.create_image(x, y, image=self.photo, anchor=anchor)
+        else:
+            self.canvas.coords(self.canvas_item, x, y)
+            self.canvas.itemconfig(self.canvas_item, image=self.photo, anchor=anchor)
+        self.canvas.image = self.photo  # Keep reference to prevent garbage collection
+
+    def on_canvas_resize(self, event):
+        """This method is bound to <Configure> and redraws the image at the new canvas size once resizing settles."""
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(50, self._redraw_after_resize)
+
+    def _redraw_after_resize(self):
+        """This method will redraw the current image after the canvas has been resized."""
+        self.resize_job = None
+        if self.zoom is not None and self.current_image is not None:
+            self.clamp_view()
+        self.display_image()
+
+    # Zoom & Pan Logic
+    def fit_scale(self):
+        """This method will return the zoom at which the whole current image fits into the canvas."""
+        h, w = self.current_image.shape[:2]
+        return self.display_size(w, h)[0] / w
+
+    def zoom_by(self, factor, x=None, y=None):
+        """This method will zoom by factor while keeping the image point under canvas position (x, y), the canvas centre by default, in place. Zooming out past the fitted size goes back to the fitted view."""
+        if self.current_image is None:
+            return
+        canvas_w, canvas_h = self.canvas_size()
+        if x is None:
+            x, y = canvas_w / 2, canvas_h / 2
+        fit = self.fit_scale()
+        if self.zoom is None:
+            self.zoom = fit
+            self.clamp_view()
+        zoom = min(self.zoom * factor, MAX_ZOOM)
+        # Small tolerance so zooming in and back out lands on the fitted view
+        if zoom <= fit * 1.001:
+            self.fit_view()
+            return
+        # Image point under the pointer stays under the pointer
+        image_x, image_y = self.view_x + x / self.zoom, self.view_y + y / self.zoom
+        self.zoom = zoom
+        self.view_x, self.view_y = image_x - x / zoom, image_y - y / zoom
+        self.clamp_view()
+        self.schedule_view()
+        self.update_status(f"Zoom {zoom * 100:.0f}%")
 
-        self.canvas.create_image(
-            canvas_w//2, canvas_h//2, image=img_tk, anchor=tk.CENTER)
-        self.canvas.image = img_tk  # Keep reference to prevent garbage collection
+    def actual_size(self):
+        """This method will zoom to 100%, where one image pixel is one screen pixel."""
+        if self.current_image is not None:
+            self.zoom_by(1 / (self.zoom or self.fit_scale()))
+
+    def fit_view(self):
+        """This method will go back to showing the whole image fitted into the canvas."""
+        if self.current_image is None:
+            return
+        self.zoom = None
+        self.display_image()
+        self.update_status("Fit to window")
+
+    def clamp_view(self):
+        """This method will keep the zoomed view on the image: an image smaller than the canvas is centred and a bigger one can't be dragged past its edges."""
+        h, w = self.current_image.shape[:2]
+        canvas_w, canvas_h = self.canvas_size()
+        view_w, view_h = canvas_w / self.zoom, canvas_h / self.zoom
+        self.view_x = (w - view_w) / 2 if view_w >= w else min(max(self.view_x, 0), w - view_w)
+        self.view_y = (h - view_h) / 2 if view_h >= h else min(max(self.view_y, 0), h - view_h)
+
+    def on_mouse_wheel(self, event):
+        """This method is bound to the mouse wheel and zooms in or out around the pointer."""
+        zoom_out = event.num == 5 or getattr(event, "delta", 0) < 0
+        self.zoom_by(1 / ZOOM_STEP if zoom_out else ZOOM_STEP, event.x, event.y)
+
+    def start_pan(self, event):
+        """This method is bound to a mouse press and remembers where a drag started."""
+        self.pan_anchor = (event.x, event.y)
+
+    def on_pan(self, event):
+        """This method is bound to dragging with the mouse and moves the zoomed view with the pointer."""
+        if self.zoom is None or self.pan_anchor is None or self.current_image is None:
+            return
+        last_x, last_y = self.pan_anchor
+        self.pan_anchor = (event.x, event.y)
+        self.view_x -= (event.x - last_x) / self.zoom
+        self.view_y -= (event.y - last_y) / self.zoom
+        self.clamp_view()
+        self.schedule_view()
+
+    def schedule_view(self):
+        """This method will redraw the view at most once per frame while zooming or panning, so moving the mouse faster only changes what the next frame shows."""
+        if self.view_job is None:
+            self.view_job = self.root.after(PREVIEW_FRAME_MS, self._redraw_view)
+
+    def _redraw_view(self):
+        """This method will draw the view after a zoom or pan."""
+        self.view_job = None
+        self.display_image()
+
+    # Live Preview Logic
+    def get_preview_proxy(self):
+        """This method will return a display sized copy of the current image, which is only rebuilt when the current image or the canvas size changes."""
+        h, w = self.current_image.shape[:2]
+        new_w, new_h = self.display_size(w, h)
+        if self.preview_source is not self.current_image or self.preview_proxy.shape[1::-1] != (new_w, new_h):
+            with self.profiler.stage("display.resize"):
+                self.preview_proxy = self.resizer.resize(
+                    self.current_image, new_w, new_h, key=self.history.current_token)
+            self.preview_source = self.current_image
+            self.preview_scale = new_w / w
+        return self.preview_proxy
+
+    def schedule_preview(self, kind):
+        """This method is called while a slider is dragged. Renders are throttled to one per frame, so moving the slider faster only changes the value the next frame shows."""
+        if self.current_image is None:
+            return
+        self.preview_kind = kind
+        if self.preview_job is None:
+            self.preview_job = self.root.after(PREVIEW_FRAME_MS, self.render_preview)
+
+    def render_preview(self):
+        """This method will run the filter of the dragged slider on the preview proxy (or only on the visible part of the image while zoomed) and show it. The full resolution image is only processed when the Apply button is pressed."""
+        self.preview_job = None
+        if self.current_image is None:
+            return
+        kind = self.preview_kind
+        if kind == "blur":
+            val = self.blur_scale.get()
+            label = f"Blur (Level {val})"
+        elif kind == "brightness":
+            val = self.bright_scale.get()
+            label = f"Brightness ({val})"
+        else:
+            val = self.contrast_scale.get()
+            label = f"Contrast (x{val})"
+
+        def apply(image, scale, out=None):
+            if kind == "blur":
+                # Scale the kernel down with the image so the preview looks like the full resolution result
+                return self.processor.apply_blur(image, int(round(val * scale)), out=out)
+            if kind == "brightness":
+                return self.processor.adjust_brightness(image, val, out=out)
+            return self.processor.adjust_contrast(image, val, out=out)
+
+        if self.zoom is None:
+            proxy = self.get_preview_proxy()
+            # Every frame is written into the same scratch buffer instead of a new array
+            out = self.processor.buffer("preview", proxy.shape, proxy.dtype)
+            self.display_image(apply(proxy, self.preview_scale, out))
+        else:
+            with self.profiler.stage("display.total"):
+                self._show_view(apply, PREVIEW_MARGIN)
+        self.status_var.set(f"Preview: {label} - press Apply to commit")
 
     def update_status(self, message):
         """This method will update the text in the status bar with the provided message and also include image dimensions if an image is loaded."""
         if self.current_image is not None:
-            h, w, _ = self.current_image.shape
+            h, w = self.current_image.shape[:2]
             info = f" | Size: {w}x{h} px"
+            if self.current_image.ndim == 2:
+                info += " (grayscale)"
         else:
             info = ""
+        # Show how much memory the undo/redo history is using
+        info += f" | History: {format_bytes(self.history.memory_usage())}"
+        spilled = self.history.disk_usage()
+        if spilled:
+            info += f" (+{format_bytes(spilled)} on disk)"
+        if len(self.documents) > 1:
+            info += f" | {len(self.documents)} open: {format_bytes(self.pool.usage())} of {format_bytes(self.pool.max_bytes)}"
         self.status_var.set(message + info)
+        if self.refresh_steps is not None:
+            self.refresh_steps()
 
-    def save_state(self):
-        """Helper to push current state to history before modification."""
-        if self.current_image is not None:
-            self.history.push_state(self.current_image)
+    def commit_image(self, result, message, operation=None, entry=None):
+        """Helper to push current state to history and then replace it with the edited result. The operation tuple (method name, args...) is added to the edit list and lets the history store reversible edits without pixels. The history entry can be built beforehand with HistoryManager.encode, e.g. on the worker thread that made the result."""
+        with self.profiler.stage("history.push"):
+            if entry is None:
+                entry = self.history.encode(self.current_image, result, operation)
+            self.history.push_entry(entry)
+        if operation is not None and self.edits is not None:
+            self.edits.append(operation)
+        self.current_image = result
+        self.pool.enforce(self.document)
+        self.save_session()
+        self.display_image()
+        self.update_status(message)
+
+    def run_filter(self, message, func, *args, operation=None):
+        """Helper that runs func(current_image, *args) on a worker thread and commits the result when it arrives. While another filter is running the call is queued, so it starts from that filter's result instead of replacing it."""
+        name = func.__name__
+        submitted = time.perf_counter()
+
+        def start():
+            base = self.current_image
+            history = self.history
+
+            def job():
+                with self.profiler.stage("filter." + name, shape=list(base.shape)):
+                    result = func(base, *args)
+                # Comparing the images for the history is about as slow as the filter, so it is done here too
+                with self.profiler.stage("history.encode"):
+                    return result, history.encode(base, result, operation)
+
+            def on_done(output):
+                result, entry = output
+                # Ignore results computed from an image that is no longer current
+                if self.current_image is base and self.history is history:
+                    self.commit_image(result, message, operation, entry)
+                    # Whole edit as the user sees it: queueing, filter, history and display
+                    self.profiler.record("apply." + name, submitted, time.perf_counter())
+                    self.refresh_timings()
+                self.next_filter()
+
+            self.tasks.submit(job, on_done=on_done, on_error=self.filter_failed)
+
+        self.queue_filter(start)
+        self.show_busy(message)
+
+    def queue_filter(self, start, supersede=None):
+        """This method will call start, which submits a job on the filter channel, right away or once the filters queued before it are committed, so every edit starts from the result of the one before. A request queued with the same supersede key right before this one is replaced instead, e.g. an edit list that changed again before it was rendered."""
+        if not self.tasks.busy("filter"):
+            start()
+        elif supersede is not None and self.filter_queue and self.filter_queue[-1][0] == supersede:
+            self.filter_queue[-1] = (supersede, start)
+        else:
+            self.filter_queue.append((supersede, start))
+
+    def next_filter(self):
+        """This method will start the next queued filter once the running one is done."""
+        if self.filter_queue and not self.tasks.busy("filter"):
+            self.filter_queue.pop(0)[1]()
+
+    def cancel_filters(self):
+        """This method will cancel the running filter and drop the queued ones, e.g. when the image they would start from is left."""
+        self.filter_queue.clear()
+        self.tasks.cancel()
+
+    def filter_failed(self, error):
+        """This method will report a failed filter. The edits queued after it were meant to build on its result, so they are dropped."""
+        self.filter_queue.clear()
+        self.task_failed(error)
+
+    def task_failed(self, error):
+        """This method will report an exception raised by a background job."""
+        self.update_status("Operation failed")
+        messagebox.showerror("Error", str(error))
+
+    def show_busy(self, message):
+        """This method will show a busy indicator in the status bar for as long as a background job is running."""
+        animating = self.busy_message is not None
+        self.busy_message = message
+        if not animating:
+            self._animate_busy(0)
+
+    def _animate_busy(self, frame):
+        """This method will advance the busy spinner until every background job has finished."""
+        if not self.tasks.busy():
+            self.busy_message = None
+            return
+        spinner = "|/-\\"[frame % 4]
+        self.status_var.set(f"{spinner} Working: {self.busy_message}...")
+        self.root.after(100, self._animate_busy, frame + 1)
 
     # Filter Callbacks (Events)
     def apply_grayscale(self):
         """Ths method will apply grayscale filter to the current image."""
         if self.current_image is not None:
-            self.save_state()
-            # If image is already grayscale (2 dim), don't fail, but processing expects BGR usually
-            if len(self.current_image.shape) == 2:
-                # Convert back to BGR so other filters work seamlessly
-                self.current_image = cv2.cvtColor(
-                    self.current_image, cv2.COLOR_GRAY2BGR)
-
-            gray = self.processor.to_grayscale(self.current_image)
-            # Convert back to BGR for consistent handling in other filters
-            self.current_image = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-            self.display_image()
-            self.update_status("Applied Grayscale")
+            self.run_filter("Applied Grayscale", self.processor.to_grayscale,
+                            operation=("to_grayscale",))
 
     def apply_blur(self):
         """This method will apply a blur effect to the current image based on the intensity selected in the blur slider."""
         if self.current_image is not None:
-            self.save_state()
             val = self.blur_scale.get()
-            self.current_image = self.processor.apply_blur(
-                self.current_image, val)
-            self.display_image()
-            self.update_status(f"Applied Blur (Level {val})")
+            self.run_filter(f"Applied Blur (Level {val})",
+                            self.processor.apply_blur, val, operation=("apply_blur", val))
 
     def apply_edge_detection(self):
         """This method will apply edge detection to the current image"""
         if self.current_image is not None:
-            self.save_state()
-            self.current_image = self.processor.detect_edges(
-                self.current_image)
-            self.display_image()
-            self.update_status("Applied Edge Detection")
+            self.run_filter("Applied Edge Detection",
+                            self.processor.detect_edges, operation=("detect_edges",))
 
     def apply_brightness(self):
         """This method will adjust the brightness of the current image based on the value selected in the brightness slider."""
         if self.current_image is not None:
-            self.save_state()
             val = self.bright_scale.get()
-            self.current_image = self.processor.adjust_brightness(
-                self.current_image, val)
-            self.display_image()
-            self.update_status(f"Adjusted Brightness ({val})")
+            self.run_filter(f"Adjusted Brightness ({val})",
+                            self.processor.adjust_brightness, val, operation=("adjust_brightness", val))
 
     def apply_contrast(self):
         """This method will adjust the contrast of the current image based on the value selected in the contrast slider."""
         if self.current_image is not None:
-            self.save_state()
             val = self.contrast_scale.get()
-            self.current_image = self.processor.adjust_contrast(
-                self.current_image, val)
-            self.display_image()
-            self.update_status(f"Adjusted Contrast (x{val})")
+            self.run_filter(f"Adjusted Contrast (x{val})",
+                            self.processor.adjust_contrast, val, operation=("adjust_contrast", val))
 
     def apply_rotate(self, angle):
         """This method will rotate the current image by the specified angle to 90, 180, or 270 degrees when the corresponding rotation button is clicked."""
         if self.current_image is not None:
-            self.save_state()
-            self.current_image = self.processor.rotate_image(
-                self.current_image, angle)
-            self.display_image()
-            self.update_status(f"Rotated {angle}°")
+            self.run_filter(f"Rotated {angle}°", self.processor.rotate_image,
+                            angle, operation=("rotate_image", angle))
 
     def apply_flip(self, mode):
         """This method will flip the current image either horizontally or vertically based on the mode parameter when the corresponding flip button is clicked. """
         if self.current_image is not None:
-            self.save_state()
-            self.current_image = self.processor.flip_image(
-                self.current_image, mode)
             direction = "Horizontal" if mode == 1 else "Vertical"
-            self.display_image()
-            self.update_status(f"Flipped {direction}")
+            self.run_filter(f"Flipped {direction}", self.processor.flip_image,
+                            mode, operation=("flip_image", mode))
 
     def apply_resize(self):
-        """This method will resize the current image based on user input for new width and height, First it will opens a dialog to ask for dimensions in the format "<width>x<height>" for an example "800x600" and then validates the input and then apply the resizing if the given input is valid, but if the input format is incorrect then it shows an error message"""
+        """This method will resize the current image based on user input for new width and height, First it will opens a dialog to ask for dimensions in the format "<width>x<height>" for an example "800x600", optionally followed by "fit" (keep the aspect ratio inside that size) or "fill" (keep the aspect ratio and crop to that size), and then validates the input and then apply the resizing if the given input is valid, but if the input format is incorrect then it shows an error message"""
         if self.current_image is not None:
             # Open a dialog to ask for new width/height
             dims = simpledialog.askstring(
-                "Resize", "Enter Width x Height (e.g. 800x600):")
+                "Resize", "Enter Width x Height, optionally with fit or fill (e.g. 800x600 fit):")
             if dims:
                 try:
-                    w_str, h_str = dims.lower().split('x')
+                    size, *rest = dims.lower().split()
+                    mode = rest[0] if rest else "stretch"
+                    w_str, h_str = size.split('x')
                     w, h = int(w_str), int(h_str)
-                    self.save_state()
-                    self.current_image = self.processor.resize_image(
-                        self.current_image, w, h)
-                    self.display_image()
-                    self.update_status(f"Resized to {w}x{h}")
+                    if len(rest) > 1 or mode not in RESIZE_MODES or w < 1 or h < 1:
+                        raise ValueError(dims)
                 except ValueError:
                     messagebox.showerror(
-                        "Error", "Invalid format. Use WidthxHeight (e.g. 400x400)")
+                        "Error", "Invalid format. Use WidthxHeight (e.g. 400x400 or 400x400 fit)")
+                    return
+                # Stretching keeps the short operation so older edit lists stay the same
+                operation = ("resize_image", w, h) if mode == "stretch" else ("resize_image", w, h, mode)
+                self.run_filter(f"Resized to {w}x{h}" + ("" if mode == "stretch" else f" ({mode})"),
+                                self.processor.resize_image, *operation[1:], operation=operation)
+
+    # Edit List Logic
+    def apply_edit_steps(self, operations, message):
+        """This method will render a changed edit list on a worker thread, reusing the cached results of the unchanged steps before the first change, and commit it as a new edit. The whole list is rendered, so a newer list that is still queued replaces this one."""
+        def start():
+            base = self.current_image
+            history = self.history
+            edits = self.edits
+
+            def job():
+                result = edits.render(operations)
+                with self.profiler.stage("history.encode"):
+                    return result, history.encode(base, result)
+
+            def on_done(output):
+                result, entry = output
+                if self.current_image is base and self.history is history:
+                    self.edits.set_operations(operations)
+                    self.commit_image(result, message, entry=entry)
+                self.next_filter()
+
+            self.tasks.submit(job, on_done=on_done, on_error=self.filter_failed)
+
+        self.queue_filter(start, supersede="edit_steps")
+        self.show_busy(message)
+
+    def show_edit_steps(self):
+        """This method opens a window listing the edit steps, where the value of a step can be changed or the step removed without undoing everything after it."""
+        if self.edits is None:
+            messagebox.showwarning("Warning", "Open an image first.")
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Edit Steps")
+        listbox = tk.Listbox(window, width=40, height=15)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        def refresh():
+            listbox.delete(0, tk.END)
+            for i, (name, *args) in enumerate(self.edits.operations):
+                listbox.insert(tk.END, f"{i + 1}. {name} {' '.join(map(str, args))}")
+
+        def selected():
+            selection = listbox.curselection()
+            return selection[0] if selection else None
+
+        def change_step():
+            i = selected()
+            if i is None:
+                return
+            name, *args = self.edits.operations[i]
+            if not args:
+                messagebox.showinfo("Info", f"{name} has no value to change.", parent=window)
+                return
+            text = simpledialog.askstring("Change Step", f"New value for {name}:",
+                                          initialvalue=" ".join(map(str, args)), parent=window)
+            if text:
+                try:
+                    operation = parse_operations(f"{name} {text.replace(',', ' ')}")[0]
+                except ValueError:
+                    messagebox.showerror("Error", "Invalid value.", parent=window)
+                    return
+                operations = list(self.edits.operations)
+                operations[i] = operation
+                self.apply_edit_steps(operations, f"Changed step {i + 1}")
+
+        def remove_step():
+            i = selected()
+            if i is not None:
+                operations = list(self.edits.operations)
+                del operations[i]
+                self.apply_edit_steps(operations, f"Removed step {i + 1}")
+
+        def close():
+            self.refresh_steps = None
+            window.destroy()
+
+        buttons = tk.Frame(window)
+        buttons.pack(pady=(0, 10))
+        tk.Button(buttons, text="Change Value", command=change_step).pack(side=tk.LEFT, padx=2)
+        tk.Button(buttons, text="Remove", command=remove_step).pack(side=tk.LEFT, padx=2)
+        tk.Button(buttons, text="Close", command=close).pack(side=tk.LEFT, padx=2)
+        window.protocol("WM_DELETE_WINDOW", close)
+        self.refresh_steps = refresh
+        refresh()
+
+    def save_edit_list(self):
+        """This method will save the edit list as JSON, so the session can be re-rendered later without storing any pixels."""
+        if self.edits is None:
+            messagebox.showwarning("Warning", "No edits to save.")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                 filetypes=[("Edit List", "*.json")])
+        if file_path:
+            self.edits.save(file_path)
+            self.update_status(f"Edit list saved: {os.path.basename(file_path)}")
+
+    def open_edit_list(self):
+        """This method will read an edit list, then decode its source image and render it on worker threads."""
+        file_path = filedialog.askopenfilename(filetypes=[("Edit List", "*.json")])
+        if not file_path:
+            return
+        try:
+            # Only the small JSON file is read here, the source is decoded like any opened image
+            data = EditGraph.read(file_path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not load edit list: {e}")
+            return
+
+        def on_rendered(rendered):
+            edits, result = rendered
+            # Sessions belong to image files, so an edit list opens in a tab without one
+            self.add_document(Document(result, edits.source_path, edits=edits))
+            self.display_image()
+            self.update_status(f"Loaded edit list: {os.path.basename(file_path)}")
+
+        def render(source):
+            edits = EditGraph.from_dict(data, source)
+            return edits, edits.render()
+
+        def on_loaded(loaded):
+            # Not on the filter channel, which belongs to the edits of the open document
+            self.tasks.submit(render, loaded[0], on_done=on_rendered, on_error=self.task_failed, channel="load")
+            self.show_busy("Rendering edit list")
+
+        self.tasks.submit(self.read_image, data["source"], on_done=on_loaded, on_error=self.task_failed, channel="load")
+        self.show_busy(f"Loading {os.path.basename(data['source'])}")
 
     def undo_action(self):
         """This method will do the undo action by getting the previous image from the history manager and updating the current image and display it to the canvas"""
-        prev = self.history.undo(self.current_image)
+        # A filter still running was started from the image we are leaving
+        self.cancel_filters()
+        start = time.perf_counter()
+        with self.profiler.stage("history.undo"):
+            prev = self.history.undo(self.current_image)
         if prev is not None:
+            self.edits.undo()
             self.current_image = prev
+            self.pool.enforce(self.document)
+            self.save_session()
             self.display_image()
             self.update_status("Undo performed")
+            self.profiler.record("undo.total", start, time.perf_counter())
+            self.refresh_timings()
         else:
             messagebox.showinfo("Info", "Nothing to undo")
 
     def redo_action(self):
         """This method will do the redo action by getting the next image from the history manager and updating the current image and display it to the canvas"""
-        nxt = self.history.redo(self.current_image)
+        self.cancel_filters()
+        start = time.perf_counter()
+        with self.profiler.stage("history.redo"):
+            nxt = self.history.redo(self.current_image)
         if nxt is not None:
+            self.edits.redo()
             self.current_image = nxt
+            self.pool.enforce(self.document)
+            self.save_session()
             self.display_image()
             self.update_status("Redo performed")
+            self.profiler.record("redo.total", start, time.perf_counter())
+            self.refresh_timings()
         else:
             messagebox.showinfo("Info", "Nothing to redo")
+
+    # Profiling
+    def toggle_timings(self):
+        """This method will show or hide the timings panel below the status bar."""
+        if self.show_timings.get():
+            self.timings_panel.pack(side=tk.TOP, fill=tk.X, after=self.status_bar)
+            self.refresh_timings()
+        else:
+            self.timings_panel.pack_forget()
+
+    def refresh_timings(self):
+        """This method will update the timings panel with the latest percentiles if it is visible."""
+        if self.show_timings.get():
+            self.timings_var.set(self.profiler.summary())
+
+    def export_trace(self):
+        """This method will save the recorded timings as a Chrome trace JSON file for offline analysis."""
+        file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                 filetypes=[("Chrome Trace", "*.json")])
+        if file_path:
+            self.profiler.export_chrome_trace(file_path)
+            self.update_status(f"Trace saved: {os.path.basename(file_path)}")
+
+    def reset_timings(self):
+        """This method will clear all recorded timings."""
+        self.profiler.reset()
+        self.refresh_timings()
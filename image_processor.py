@@ -1,66 +1,233 @@
 import cv2
+import numpy as np
+from resizer import resize
+
+
+# Operations that map every channel value on its own, so a chain of them collapses into one lookup table
+POINT_OPERATIONS = {"adjust_contrast"}
+
+# Operations that only move pixels around
+GEOMETRIC_OPERATIONS = {"rotate_image", "flip_image"}
+
+# Operations whose result for a pixel doesn't depend on where it is, so pending geometric operations can be moved past them.
+# adjust_brightness is left out because OpenCV's HSV to BGR conversion rounds the last pixels of a row differently (on single-channel images it is fused as a point operation instead).
+PIXEL_OPERATIONS = POINT_OPERATIONS | {"to_grayscale", "to_grayscale_bgr"}
+
+# Lookup table that leaves every value unchanged
+IDENTITY_LUT = np.arange(256, dtype=np.uint8).reshape(1, 256)
+
+# Methods that edit lists, session files and the batch command line may name. Helpers like run_pipeline, buffer and the batch variants are left out, so a file can't make the editor call them.
+EDIT_OPERATIONS = frozenset({
+    "to_grayscale", "to_grayscale_bgr", "apply_blur", "detect_edges", "adjust_brightness",
+    "adjust_contrast", "rotate_image", "flip_image", "resize_image",
+})
+
+# Operations that can write their result over their input (out=image)
+IN_PLACE_OPERATIONS = {"apply_blur", "adjust_brightness", "adjust_contrast"}
+
+# Small array with unique values used to work out what a chain of geometric operations does
+_MARKER = np.arange(6, dtype=np.int32).reshape(2, 3)
+
+# The eight rotations and flips of a rectangle, each done with as few OpenCV calls as possible
+_TRANSFORMS = [
+    lambda img: img,
+    lambda img: cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE),
+    lambda img: cv2.rotate(img, cv2.ROTATE_180),
+    lambda img: cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE),
+    lambda img: cv2.flip(img, 0),
+    lambda img: cv2.flip(img, 1),
+    lambda img: cv2.transpose(img),
+    lambda img: cv2.flip(cv2.transpose(img), -1),
+]
+_TRANSFORM_LOOKUP = {(t(_MARKER).shape, t(_MARKER).tobytes()): t for t in _TRANSFORMS}
 
 
 class ImageProcessor:
     """
     This class contains static methods or instance methods for image processing logic.
+    Every method works on both BGR (H x W x 3) and single-channel (H x W) images, and grayscale results stay single-channel so they take a third of the memory and time in later steps.
+    Every filter takes an optional out array to write the result into instead of allocating a new one. apply_blur, adjust_brightness and adjust_contrast also work in place (out=image), so with them an edit needs no memory beyond the input and the output, about 2x the image size.
+    An instance owns reusable scratch buffers (see buffer) for callers that run the same operation over and over, like the live preview.
     """
 
+    def __init__(self):
+        self._buffers = {}
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """This method will return the scratch buffer with the given name, only allocating a new one when the shape or dtype changes."""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+
+    @staticmethod
+    def to_grayscale(image, out=None):
+        """This method will convert the input image to a single-channel grayscale image. An image that is already grayscale is copied."""
+        if image.ndim == 2:
+            if out is None:
+                return image.copy()
+            np.copyto(out, image)
+            return out
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=out)
+
     @staticmethod
-    def to_grayscale(image):
-        """This method will convert the input image to grayscale."""
-        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def to_grayscale_bgr(image, out=None):
+        """This method will convert the input image to grayscale and back to BGR so other filters work seamlessly."""
+        # If image is already grayscale (2 dim), don't fail, but processing expects BGR usually
+        if len(image.shape) == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # Convert back to BGR for consistent handling in other filters
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=out)
 
     @staticmethod
-    def apply_blur(image, kernel_size):
+    def apply_blur(image, kernel_size, out=None):
         """
         This method will apply a Gaussian blur to the input image.
         and kernel size will be a odd number and it will be checked internally.
         """
         k = kernel_size if kernel_size % 2 == 1 else kernel_size + 1
-        return cv2.GaussianBlur(image, (k, k), 0)
+        return cv2.GaussianBlur(image, (k, k), 0, dst=out)
 
     @staticmethod
-    def detect_edges(image):
-        """This method will apply Canny edge detection to the input image."""
+    def detect_edges(image, out=None):
+        """This method will apply Canny edge detection to the input image. The result is a single-channel edge map."""
         # Convert to gray first for better edge detection
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         # Using standard threshold values
-        edges = cv2.Canny(gray, 100, 200)
-        # Convert back to BGR so it displays correctly in the app
-        return cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
+        return cv2.Canny(gray, 100, 200, edges=out)
 
     @staticmethod
-    def adjust_brightness(image, value):
-        """This method will adjust the brightness of the input image."""
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-        v = cv2.add(v, value)  # Prevents overflow using cv2.add
-        final_hsv = cv2.merge((h, s, v))
-        return cv2.cvtColor(final_hsv, cv2.COLOR_HSV2BGR)
+    def adjust_brightness(image, value, out=None):
+        """This method will adjust the brightness of the input image. The V channel is changed through a lookup table while the image is in HSV, so no planes are split or merged and the whole edit happens inside out."""
+        if image.ndim == 2:
+            # A gray pixel is its own V channel, so the same edit is a plain lookup table (cv2.add saturates instead of overflowing)
+            return cv2.LUT(image, cv2.add(IDENTITY_LUT, value), dst=out)
+        # H and S stay the same, V gets the value added
+        lut = cv2.merge((IDENTITY_LUT, IDENTITY_LUT, cv2.add(IDENTITY_LUT, value)))
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=out)
+        cv2.LUT(hsv, lut, dst=hsv)
+        return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=hsv)
 
     @staticmethod
-    def adjust_contrast(image, factor):
+    def adjust_contrast(image, factor, out=None):
         "This method will adjust the contrast of the input image."
-        return cv2.convertScaleAbs(image, alpha=factor, beta=0)
+        return cv2.convertScaleAbs(image, dst=out, alpha=factor, beta=0)
 
     @staticmethod
-    def rotate_image(image, angle):
+    def rotate_image(image, angle, out=None):
         """This method will rotate the input image by a specified angle (90, 180, or 270 degrees)."""
         if angle == 90:
-            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE, dst=out)
         elif angle == 180:
-            return cv2.rotate(image, cv2.ROTATE_180)
+            return cv2.rotate(image, cv2.ROTATE_180, dst=out)
         elif angle == 270:
-            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=out)
+        if out is not None:
+            np.copyto(out, image)
+            return out
         return image
 
     @staticmethod
-    def flip_image(image, mode):
+    def flip_image(image, mode, out=None):
         """This method will flip the input image either vertically or horizontally based on the mode parameter. if mode is 0, it will flip vertically; if mode is 1, it will flip horizontally."""
-        return cv2.flip(image, mode)
+        return cv2.flip(image, mode, dst=out)
+
+    @staticmethod
+    def resize_image(image, width, height, mode="stretch", out=None):
+        """This method will resize the input image to the specified width and height. With mode "fit" the aspect ratio is kept inside that size and with "fill" the image covers it and is cropped. The interpolation is chosen from the direction and factor of the resize (see resizer.resize)."""
+        return resize(image, width, height, mode, out=out)
+
+    @staticmethod
+    def run_pipeline(image, operations):
+        """
+        This method will apply a sequence of operations given as (method name, args...) tuples, e.g. [("adjust_contrast", 1.2), ("rotate_image", 90)].
+        Adjacent point operations are fused into a single lookup table applied with one cv2.LUT call, and rotations and flips are folded into one transform that is moved past per-pixel operations. The result is pixel-identical to calling the methods one at a time.
+        """
+        result = image
+        lut = None
+        marker = _MARKER
+
+        def flush_lut(img):
+            return img if lut is None else cv2.LUT(img, lut)
+
+        def flush_geometry(img):
+            return _TRANSFORM_LOOKUP[(marker.shape, marker.tobytes())](img)
+
+        for name, *args in operations:
+            method = getattr(ImageProcessor, name)
+            if result.dtype != np.uint8:
+                # cv2.LUT only takes 8-bit images, so e.g. 16-bit .npy tiles run every method on its own
+                result = flush_geometry(result)
+                marker = _MARKER
+                result = method(result, *args)
+            elif name in POINT_OPERATIONS or (name == "adjust_brightness" and result.ndim == 2):
+                # Brightness of a single-channel image is a plain lookup table too
+                # Running the operation on the identity table gives its table, exactly as OpenCV rounds it
+                lut = method(IDENTITY_LUT if lut is None else lut, *args)
+            elif name in GEOMETRIC_OPERATIONS:
+                marker = method(marker, *args)
+            else:
+                result = flush_lut(result)
+                lut = None
+                if name not in PIXEL_OPERATIONS:
+                    # Neighbourhood and resize operations depend on pixel positions
+                    result = flush_geometry(result)
+                    marker = _MARKER
+                result = method(result, *args)
+
+        return flush_geometry(flush_lut(result))
+
+    # Batch variants for stacks of same-size images (N x H x W x C arrays or lists of images)
+    @staticmethod
+    def _batch_output(out, shape, dtype=np.uint8):
+        """This method will check a preallocated output buffer or allocate a new one."""
+        if out is None:
+            return np.empty(shape, dtype=dtype)
+        if out.shape != tuple(shape) or out.dtype != dtype or not out.flags.c_contiguous:
+            raise ValueError(f"out must be a contiguous {np.dtype(dtype)} array of shape {tuple(shape)}")
+        return out
+
+    @staticmethod
+    def to_grayscale_batch(images, out=None):
+        """This method will convert a stack of BGR images to grayscale in a single OpenCV call, writing into out (N x H x W) if it is given. The result is identical to calling to_grayscale on every image."""
+        if isinstance(images, np.ndarray):
+            n, h, w = images.shape[:3]
+            out = ImageProcessor._batch_output(out, (n, h, w))
+            if images.ndim == 3:
+                # Already a stack of grayscale images
+                np.copyto(out, images)
+                return out
+            # Rows keep their width, so the stack can be converted as one tall image
+            cv2.cvtColor(np.ascontiguousarray(images).reshape(n * h, w, -1),
+                         cv2.COLOR_BGR2GRAY, dst=out.reshape(n * h, w))
+            return out
+        h, w = images[0].shape[:2]
+        out = ImageProcessor._batch_output(out, (len(images), h, w))
+        for i, image in enumerate(images):
+            ImageProcessor.to_grayscale(image, out=out[i])
+        return out
+
+    @staticmethod
+    def adjust_contrast_batch(images, factor, out=None):
+        """This method will adjust the contrast of a stack of images in a single OpenCV call, writing into out if it is given. The result is identical to calling adjust_contrast on every image."""
+        if isinstance(images, np.ndarray):
+            out = ImageProcessor._batch_output(out, images.shape)
+            # Every value is scaled on its own, so the whole stack is treated as one flat image
+            flat = np.ascontiguousarray(images).reshape(images.shape[0] * images.shape[1], -1)
+            cv2.convertScaleAbs(flat, dst=out.reshape(flat.shape), alpha=factor, beta=0)
+            return out
+        out = ImageProcessor._batch_output(out, (len(images),) + images[0].shape)
+        for i, image in enumerate(images):
+            cv2.convertScaleAbs(image, dst=out[i], alpha=factor, beta=0)
+        return out
 
     @staticmethod
-    def resize_image(image, width, height):
-        """This method will resize the input image to the specified width and height using cv2.resize with INTER_AREA interpolation for better quality when reducing size."""
-        return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    def resize_image_batch(images, width, height, out=None):
+        """This method will resize every image of a stack to width x height, writing straight into out (N x height x width x C) if it is given instead of allocating a new array per image. The result is identical to calling resize_image on every image."""
+        channels = images[0].shape[2:]
+        out = ImageProcessor._batch_output(out, (len(images), height, width) + channels)
+        for i, image in enumerate(images):
+            resize(image, width, height, out=out[i])
+        return out
@@ -0,0 +1,110 @@
+import math
+import cv2
+import numpy as np
+
+
+# Levels are added until the image fits into this many pixels on its longest side
+MIN_LEVEL_SIZE = 256
+
+
+def _affected_span(a0, a1, src_size, dst_size):
+    """This function will return the range of next level indices touched by a change to source indices a0 to a1, and the source range needed to recompute them exactly."""
+    # cv2.pyrDown uses a 5 tap kernel, so output j reads source 2j-2 to 2j+2
+    t0 = max((a0 - 1) // 2, 0)
+    t1 = min((a1 + 1) // 2 + 1, dst_size)
+    return t0, t1, max(2 * t0 - 2, 0), min(2 * t1 + 1, src_size)
+
+
+class ImagePyramid:
+    """
+    Class that keeps a multi-resolution pyramid of an image for the zoomable view.
+    Level 0 is the image itself and every following level is half the size of the one before it (cv2.pyrDown). Levels are only built when a view first needs them, and after an edit only the changed region is recomputed on the levels that exist, which gives exactly the same pixels as rebuilding them.
+    """
+
+    def __init__(self, image, token=None, min_size=MIN_LEVEL_SIZE):
+        self.min_size = min_size
+        # History state token of the image the pyramid was built for
+        self.token = token
+        self._reset(image)
+
+    @property
+    def image(self):
+        """This property will return the full resolution image."""
+        return self.levels[0]
+
+    def level(self, k):
+        """This method will return level k (clamped to the smallest level), building the levels up to it if they don't exist yet."""
+        k = min(k, len(self.sizes) - 1)
+        while len(self.levels) <= k:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+        return self.levels[k]
+
+    def level_for_scale(self, scale):
+        """This method will return the smallest level that still has at least scale pixels per image pixel, so it is only ever shrunk for display."""
+        w = self.sizes[0][1]
+        k = 0
+        while k + 1 < len(self.sizes) and self.sizes[k + 1][1] >= w * scale:
+            k += 1
+        return k
+
+    def update(self, image, token=None, region=None):
+        """This method will switch the pyramid to an edited image. region is the (y0, y1, x0, x1) box where it differs from the previous image, only that part is recomputed on the levels that were built. Without a region, or if the size changed, the levels are dropped and built again when needed."""
+        self.token = token
+        if region is None or image.shape != self.levels[0].shape:
+            self._reset(image)
+            return
+        self.levels[0] = image
+        y0, y1, x0, x1 = region
+        for k in range(1, len(self.levels)):
+            if y1 <= y0 or x1 <= x0:
+                break
+            src, dst = self.levels[k - 1], self.levels[k]
+            ty0, ty1, cy0, cy1 = _affected_span(y0, y1, src.shape[0], dst.shape[0])
+            tx0, tx1, cx0, cx1 = _affected_span(x0, x1, src.shape[1], dst.shape[1])
+            small = cv2.pyrDown(src[cy0:cy1, cx0:cx1])
+            # The crop starts on an even index, so its result lines up with the level at half its offset
+            dst[ty0:ty1, tx0:tx1] = small[ty0 - cy0 // 2:ty1 - cy0 // 2, tx0 - cx0 // 2:tx1 - cx0 // 2]
+            y0, y1, x0, x1 = ty0, ty1, tx0, tx1
+
+    def render(self, x, y, scale, width, height, func=None, margin=0):
+        """
+        This method will return the part of the image visible in a width x height view that shows image point (x, y) in its top left corner at scale display pixels per image pixel, together with the view position of the frame's top left corner.
+        Only the visible region of the best level is cropped and resized, so the cost depends on the view size and not on the image size. func(crop, level_scale) can process the crop before it is resized, with margin extra level pixels around it so neighbourhood filters are right at the view edges. It returns (None, None) if no part of the image is visible.
+        """
+        h, w = self.sizes[0]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width / scale, w), min(y + height / scale, h)
+        if x1 <= x0 or y1 <= y0:
+            return None, None
+
+        level = self.level(self.level_for_scale(scale))
+        lh, lw = level.shape[:2]
+        sx, sy = lw / w, lh / h
+        # Whole level pixels covering the visible box
+        lx0, ly0 = int(x0 * sx), int(y0 * sy)
+        lx1, ly1 = min(math.ceil(x1 * sx), lw), min(math.ceil(y1 * sy), lh)
+        if func is None:
+            crop = level[ly0:ly1, lx0:lx1]
+        else:
+            mx0, my0 = max(lx0 - margin, 0), max(ly0 - margin, 0)
+            mx1, my1 = min(lx1 + margin, lw), min(ly1 + margin, lh)
+            crop = func(np.ascontiguousarray(level[my0:my1, mx0:mx1]), sx)
+            crop = crop[ly0 - my0:ly1 - my0, lx0 - mx0:lx1 - mx0]
+
+        # Where the edges of the crop end up in the view
+        vx0, vy0 = round((lx0 / sx - x) * scale), round((ly0 / sy - y) * scale)
+        vx1, vy1 = round((lx1 / sx - x) * scale), round((ly1 / sy - y) * scale)
+        size = (max(vx1 - vx0, 1), max(vy1 - vy0, 1))
+        # Enlarged pixels stay sharp so they can be inspected, reductions are averaged to avoid aliasing
+        interpolation = cv2.INTER_NEAREST if scale > sx else cv2.INTER_AREA
+        return cv2.resize(crop, size, interpolation=interpolation), (vx0, vy0)
+
+    def _reset(self, image):
+        """This method will drop every level but the image itself."""
+        self.levels = [image]
+        # Sizes of every level are known up front, the pixels are computed lazily
+        self.sizes = [image.shape[:2]]
+        h, w = self.sizes[0]
+        while max(h, w) > self.min_size:
+            h, w = (h + 1) // 2, (w + 1) // 2
+            self.sizes.append((h, w))
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import numpy as np
+
+
+class Profiler:
+    """
+    Class that times the stages of the editor's hot paths.
+    Every stage keeps a rolling window of its latest durations for percentiles, and every timing is also kept as a Chrome trace event so a session can be exported and opened in chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, window=200, max_events=100000):
+        self.window = window
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._events = deque(maxlen=max_events)
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    @contextmanager
+    def stage(self, name, **args):
+        """This method is a context manager that times the code inside it as the given stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), **args)
+
+    def record(self, name, start, end, **args):
+        """This method will store one timing given as time.perf_counter() values. It can be called from any thread."""
+        self._samples[name].append((end - start) * 1000)
+        self._events.append({
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            # Chrome traces use microseconds
+            "ts": (start - self._origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+
+    def percentiles(self, name, quantiles=(50, 95, 99)):
+        """This method will return the given percentiles (in milliseconds) of the recent durations of a stage."""
+        samples = self._samples.get(name)
+        if not samples:
+            return None
+        return dict(zip(quantiles, np.percentile(list(samples), quantiles)))
+
+    def last(self, name):
+        """This method will return the latest duration of a stage in milliseconds."""
+        samples = self._samples.get(name)
+        return samples[-1] if samples else None
+
+    def summary(self):
+        """This method will return a text table with the count and p50/p95/p99 of every stage."""
+        lines = [f"{'stage':<28}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for name in sorted(self._samples):
+            p = self.percentiles(name)
+            if p is not None:
+                lines.append(f"{name:<28}{len(self._samples[name]):>6}{p[50]:>10.2f}{p[95]:>10.2f}{p[99]:>10.2f}")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        """This method will write all recorded timings as a Chrome trace JSON file."""
+        with open(path, "w") as f:
+            json.dump({"traceEvents": list(self._events), "displayTimeUnit": "ms"}, f)
+
+    def reset(self):
+        """This method will drop every recorded timing."""
+        self._samples.clear()
+        self._events.clear()
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+
+# stretch resizes to exactly the given size, fit keeps the aspect ratio inside it and fill keeps the aspect ratio and crops what sticks out
+RESIZE_MODES = ("stretch", "fit", "fill")
+
+# Number of results a Resizer keeps
+DEFAULT_CACHE_SIZE = 8
+
+
+def target_size(width, height, box_width, box_height, mode="stretch"):
+    """This function will return the size an image of width x height is resized to for a box of box_width x box_height in the given mode. For fill the result still has to be cropped to the box."""
+    if mode not in RESIZE_MODES:
+        raise ValueError(f"Unknown resize mode: {mode}")
+    if mode == "stretch":
+        return box_width, box_height
+    scale_x, scale_y = box_width / width, box_height / height
+    scale = min(scale_x, scale_y) if mode == "fit" else max(scale_x, scale_y)
+    # The side that decides the scale gets the box size exactly instead of a rounded product
+    new_w = box_width if scale == scale_x else max(1, round(width * scale))
+    new_h = box_height if scale == scale_y else max(1, round(height * scale))
+    return new_w, new_h
+
+
+def choose_interpolation(width, height, new_width, new_height):
+    """This function will pick the interpolation for a resize: area averaging for reductions (no aliasing), bicubic for enlargements (sharper than bilinear at about the same speed) and bilinear when one side grows and the other shrinks."""
+    if new_width <= width and new_height <= height:
+        return cv2.INTER_AREA
+    if new_width >= width and new_height >= height:
+        return cv2.INTER_CUBIC
+    return cv2.INTER_LINEAR
+
+
+def resize(image, width, height, mode="stretch", interpolation=None, out=None):
+    """
+    This function will resize an image to width x height in the given mode (see RESIZE_MODES), writing into out if it is given.
+    The interpolation is chosen with choose_interpolation unless it is given. Reductions by 2x or more are first halved with cv2.pyrDown until less than 2x is left and finished with an area pass, which is about twice as fast as one area pass over the full image and looks almost the same. Whole factors (like exactly half the size) skip this, as OpenCV's area filter has a fast path for them.
+    """
+    h, w = image.shape[:2]
+    new_w, new_h = target_size(w, h, width, height, mode)
+    if interpolation is None:
+        interpolation = choose_interpolation(w, h, new_w, new_h)
+        if interpolation == cv2.INTER_AREA and (w % new_w or h % new_h):
+            while image.shape[1] >= 2 * new_w and image.shape[0] >= 2 * new_h:
+                image = cv2.pyrDown(image)
+
+    if mode != "fill" or (new_w, new_h) == (width, height):
+        return cv2.resize(image, (new_w, new_h), dst=out, interpolation=interpolation)
+    # Cut the middle of the box out of the covering image
+    result = cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+    x0, y0 = (new_w - width) // 2, (new_h - height) // 2
+    crop = result[y0:y0 + height, x0:x0 + width]
+    if out is None:
+        return np.ascontiguousarray(crop)
+    np.copyto(out, crop)
+    return out
+
+
+class Resizer:
+    """
+    Class that resizes images with resize and keeps the latest results in an LRU, so asking for the same image at the same size again (after undo and redo, or when the window goes back to a size) returns the earlier result.
+    Only calls given a key are cached. The key has to identify the pixels, like a history state token, because arrays can be changed in place.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+
+    def resize(self, image, width, height, mode="stretch", key=None):
+        """This method will return the image resized with resize, from the cache if it was resized the same way for the same key before. Cached results are shared, so they must not be changed."""
+        if key is None:
+            return resize(image, width, height, mode)
+        cache_key = (key, width, height, mode)
+        result = self._cache.get(cache_key)
+        if result is not None:
+            self._cache.move_to_end(cache_key)
+            return result
+        result = resize(image, width, height, mode)
+        self._cache[cache_key] = result
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        """This method will drop every cached result."""
+        self._cache.clear()
@@ -0,0 +1,326 @@
+import hashlib
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import numpy as np
+from history_manager import HistoryEntry, HistoryManager
+
+
+# Where the editor keeps one session file per opened image
+SESSION_DIR = os.path.join(os.path.expanduser("~"), ".hit137_editor", "sessions")
+
+# First bytes of every session file
+MAGIC = b"HIT137SESSION1\n"
+
+# Every record starts with the length of its JSON header and of its payload
+_RECORD_HEADER = struct.Struct("<IQ")
+
+# Longest chain of history steps replayed to rebuild the current image before a new checkpoint is written
+MAX_REPLAY_STEPS = 8
+
+# The file is rewritten with only the live records once it is this many times larger than them (and above COMPACT_MIN_BYTES)
+COMPACT_RATIO = 2
+COMPACT_MIN_BYTES = 64 * 1024 * 1024
+
+# History entry meta fields that are tuples in memory but come back from JSON as lists
+_TUPLE_FIELDS = ("bbox", "shape", "operation", "forward")
+
+
+def session_path(source_path, directory=SESSION_DIR):
+    """This function will return the session file used for an image file."""
+    key = hashlib.sha1(os.path.abspath(source_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, key + ".session")
+
+
+def source_stamp(source_path):
+    """This function will return what identifies the version of an image file, so a session is only offered for the file it was made from."""
+    stat = os.stat(source_path)
+    return {"path": os.path.abspath(source_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def prune_sessions(max_age_days=30, directory=SESSION_DIR):
+    """This function will delete session files that haven't been written to for max_age_days."""
+    if not os.path.isdir(directory):
+        return
+    limit = time.time() - max_age_days * 86400
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(".session") and os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _scan(buffer):
+    """This function will walk the records of a session file and yield (id, kind, meta, payload offset, payload length, record offset, record length) for each one. A record cut short by a crash ends the walk."""
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a session file")
+    offset = len(MAGIC)
+    size = len(buffer)
+    while offset + _RECORD_HEADER.size <= size:
+        header_len, payload_len = _RECORD_HEADER.unpack_from(buffer, offset)
+        start = offset + _RECORD_HEADER.size
+        end = start + header_len + payload_len
+        if end > size:
+            break
+        try:
+            header = json.loads(bytes(buffer[start:start + header_len]))
+        except ValueError:
+            break
+        yield header["id"], header["kind"], header["meta"], start + header_len, payload_len, offset, end - offset
+        offset = end
+
+
+class SessionStore:
+    """
+    Class that keeps an append-only session file with the original image, the compressed undo/redo history and the edit list, so a session survives closing or crashing the editor.
+    Records are written on a background thread after every edit. History entries are stored with the data they are already compressed with, and a raw checkpoint of the current image is only added when it can't be rebuilt from an earlier one in a few steps. On reopen the file is memory-mapped: entries point straight into the map and are only decompressed when they are undone or redone, so restoring a long history takes milliseconds.
+    """
+
+    def __init__(self, path, file, index, next_id, original_id):
+        self.path = path
+        self._file = file
+        # Record id -> (offset, length) of the whole record in the current file
+        self._index = index
+        self._next_id = next_id
+        self._original_id = original_id
+        # id(entry) -> (entry, record id) of history entries that are already in the file
+        self._written = {}
+        # State token -> record id of images (checkpoints and the original) that are in the file
+        self._images = {}
+        # Set by the writer thread if the file can't be written, the session then stops recording
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def create(cls, path, original, token, info=None):
+        """This method will start a new session file (replacing an old one) holding the original image as the state with the given token."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        file = open(path, "wb")
+        file.write(MAGIC)
+        file.flush()
+        store = cls(path, file, {}, 0, None)
+        store._append("start", info or {})
+        store._original_id = store._append_image(original, token)
+        return store
+
+    @staticmethod
+    def peek(path):
+        """This method will return the information stored with the latest complete state of a session file (see record), or None if there is no usable session."""
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start, state = None, None
+                for _, kind, meta, *_ in _scan(mm):
+                    if kind == "start":
+                        start = meta
+                    elif kind == "state":
+                        state = meta
+        except (OSError, ValueError):
+            return None
+        if state is None:
+            return None
+        return {"start": start, "undo": len(state["undo"]), "redo": len(state["redo"]), "info": state["info"]}
+
+    @classmethod
+    def restore(cls, path, history=None):
+        """
+        This method will reopen a session file and continue it. The history (a new HistoryManager by default) gets the undo and redo stacks of the latest state, with their data left in the memory-mapped file.
+        It returns the store, the history, the current image, the original image and the information stored with the state.
+        """
+        file = open(path, "r+b")
+        # Copy-on-write, so images taken from the map can be changed without touching the file
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        records, index, state = {}, {}, None
+        for rid, kind, meta, offset, length, record_offset, record_length in _scan(mm):
+            records[rid] = (kind, meta, offset, length)
+            index[rid] = (record_offset, record_length)
+            if kind == "state":
+                state = meta
+                state_end = record_offset + record_length
+        if state is None:
+            mm.close()
+            file.close()
+            raise ValueError("The session has no saved state")
+        # Anything after the last state was never referenced, so it is cut off before appending
+        file.truncate(state_end)
+        file.seek(state_end)
+
+        def image_at(rid):
+            _, meta, offset, _ = records[rid]
+            dtype = np.dtype(meta["dtype"])
+            count = int(np.prod(meta["shape"]))
+            return np.frombuffer(mm, dtype=dtype, count=count, offset=offset).reshape(meta["shape"])
+
+        entries = {}
+        for rid, _ in state["undo"] + state["redo"]:
+            _, meta, offset, length = records[rid]
+            entry_meta = {key: tuple(value) if key in _TUPLE_FIELDS and value is not None else value
+                          for key, value in meta["meta"].items()}
+            # The data stays in the map until the entry is undone or redone
+            data = memoryview(mm)[offset:offset + length] if length else None
+            entries[rid] = HistoryEntry(meta["kind"], entry_meta, data, mapped=data is not None)
+
+        history = history or HistoryManager()
+        undo = [entries[rid] for rid, _ in state["undo"]]
+        redo = [entries[rid] for rid, _ in state["redo"]]
+        # The stacks decide which data stays in RAM, so they are set up before anything is replayed
+        history.restore_stacks(undo, redo)
+
+        # Rebuild the current image from the nearest image in the file
+        base = state["base"]
+        image = image_at(base["record"])
+        for rid in base["steps"]:
+            image = history.apply_entry(entries[rid], image, reverse=True)
+
+        store = cls(path, file, index, max(records) + 1, state["original"])
+        store._mmap = mm
+        for entry, (rid, _) in zip(undo + redo, state["undo"] + state["redo"]):
+            store._written[id(entry)] = (entry, rid)
+        # Images in the file are known again under the fresh tokens of their states
+        old_tokens = [token for _, token in state["undo"]] + [state["current"]] + [token for _, token in reversed(state["redo"])]
+        new_tokens = [e.token for e in undo] + [history.current_token] + [e.token for e in reversed(redo)]
+        mapping = dict(zip(old_tokens, new_tokens))
+        for token, rid in state["images"]:
+            if token in mapping:
+                store._images[mapping[token]] = rid
+        return store, history, image, image_at(state["original"]), state["info"]
+
+    def record(self, history, current_image, info=None):
+        """This method will queue a state record for the current history: entries that aren't in the file yet, a checkpoint of the current image if it is too far from any stored image, and the JSON serializable info (e.g. the edit list). It runs on the Tk thread and only hands references to the writer thread."""
+        if self.error is not None:
+            return
+        undo, redo = history.stacks()
+        live = {}
+        for entry in undo + redo:
+            written = self._written.get(id(entry))
+            if written is None or written[0] is not entry:
+                rid = self._append("entry", {"kind": entry.kind, "meta": entry.meta}, history.entry_data(entry, deferred=True))
+                written = (entry, rid)
+            live[id(entry)] = written
+        self._written = live
+
+        # States in order: undo[i] sits between states i and i + 1, the current image is state len(undo)
+        tokens = [e.token for e in undo] + [history.current_token] + [e.token for e in reversed(redo)]
+        edges = undo + redo[::-1]
+        self._images = {token: rid for token, rid in self._images.items() if token in tokens}
+        base = self._find_base(tokens, edges, len(undo))
+        if base is None:
+            rid = self._append_image(current_image, history.current_token)
+            base = {"record": rid, "steps": []}
+
+        self._append("state", {
+            "undo": [[self._written[id(e)][1], e.token] for e in undo],
+            "redo": [[self._written[id(e)][1], e.token] for e in redo],
+            "current": history.current_token,
+            "base": base,
+            "images": [[token, rid] for token, rid in self._images.items()],
+            "original": self._original_id,
+            "info": info or {},
+        })
+
+    def close(self):
+        """This method will wait until everything queued has been written and close the file."""
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def _find_base(self, tokens, edges, current):
+        """This method will find the nearest state with an image in the file from which the current image can be rebuilt in at most MAX_REPLAY_STEPS, and return its record and the entries to walk (in reverse) from there."""
+        for distance in range(MAX_REPLAY_STEPS + 1):
+            for position in (current - distance, current + distance):
+                if not 0 <= position < len(tokens) or tokens[position] not in self._images:
+                    continue
+                if position < current:
+                    path = edges[position:current]
+                else:
+                    path = edges[current:position][::-1]
+                # Walking towards the current image goes against every entry, which full copies can't do
+                if any(entry.kind == "full" for entry in path):
+                    continue
+                return {"record": self._images[tokens[position]],
+                        "steps": [self._written[id(entry)][1] for entry in path]}
+        return None
+
+    def _append_image(self, image, token):
+        """This method will queue a raw copy of an image, so it can later be used straight from the memory map."""
+        image = np.ascontiguousarray(image)
+        rid = self._append("image", {"token": token, "shape": list(image.shape), "dtype": image.dtype.str}, image)
+        self._images[token] = rid
+        return rid
+
+    def _append(self, kind, meta, payload=b""):
+        """This method will queue a record for the writer thread and return its id. The payload can also be a function returning it, which is called on the writer thread."""
+        rid = self._next_id
+        self._next_id += 1
+        header = json.dumps({"id": rid, "kind": kind, "meta": meta}, separators=(",", ":")).encode("utf-8")
+        self._queue.put((rid, kind, meta, header, payload))
+        return rid
+
+    def _write_loop(self):
+        """This method runs on the writer thread and appends queued records to the file."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            rid, kind, meta, header, payload = item
+            try:
+                if callable(payload):
+                    # History steps that aren't compressed yet are compressed here instead of on the Tk thread
+                    payload = payload()
+                payload = memoryview(payload).cast("B")
+                offset = self._file.tell()
+                self._file.write(_RECORD_HEADER.pack(len(header), payload.nbytes))
+                self._file.write(header)
+                self._file.write(payload)
+                self._index[rid] = (offset, self._file.tell() - offset)
+                if kind == "state":
+                    # A state is complete once it is flushed, so a crash loses at most the edit being written
+                    self._file.flush()
+                    self._compact(meta, rid)
+            except OSError as e:
+                self.error = e
+
+    def _compact(self, state, state_id):
+        """This method will rewrite the file with only the records the latest state needs, once dead records take up most of it."""
+        live = {rid for rid, _ in state["undo"] + state["redo"]}
+        live |= {rid for _, rid in state["images"]}
+        # Record 0 is the start record with the source file stamp
+        live |= {0, state["original"], state["base"]["record"], state_id}
+        live_bytes = sum(self._index[rid][1] for rid in live if rid in self._index)
+        size = self._file.tell()
+        if size < COMPACT_MIN_BYTES or size < COMPACT_RATIO * live_bytes:
+            return
+
+        tmp_path = self.path + ".tmp"
+        index = {}
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            dst.write(MAGIC)
+            for rid in sorted(live):
+                if rid not in self._index:
+                    continue
+                offset, length = self._index[rid]
+                src.seek(offset)
+                index[rid] = (dst.tell(), length)
+                # Copied in chunks so large checkpoints don't need to fit into RAM twice
+                while length > 0:
+                    chunk = src.read(min(length, 16 * 1024 * 1024))
+                    dst.write(chunk)
+                    length -= len(chunk)
+        try:
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # The old file is still in use (Windows keeps mapped files locked), so compaction waits for the next session
+            os.remove(tmp_path)
+            return
+        self._file.close()
+        self._file = open(self.path, "ab")
+        self._index = index
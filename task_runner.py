@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Task:
+    """
+    Class that keeps track of one submitted job and the callbacks to run on the Tk thread when it finishes.
+    """
+
+    def __init__(self, future, on_done, on_error):
+        self.future = future
+        self.on_done = on_done
+        self.on_error = on_error
+
+
+class TaskRunner:
+    """
+    Class that runs heavy work on background threads and hands the results back to the Tk event loop.
+    Jobs are grouped into channels (e.g. "filter", "load", "save") and a newer job in a channel supersedes the older one: a queued job is cancelled and the result of a running job is thrown away.
+    OpenCV releases the GIL while it works, so the window keeps responding during a filter.
+    """
+
+    def __init__(self, root, max_workers=2, poll_interval=15):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task")
+        self._tasks = {}
+
+    def submit(self, func, *args, on_done=None, on_error=None, channel="filter"):
+        """This method will run func(*args) on a worker thread and later call on_done(result) or on_error(exception) on the Tk thread, cancelling any older job in the same channel."""
+        self.cancel(channel)
+        task = Task(self._executor.submit(func, *args), on_done, on_error)
+        self._tasks[channel] = task
+        self.root.after(self.poll_interval, self._poll, channel, task)
+        return task
+
+    def cancel(self, channel="filter"):
+        """This method will cancel the job of a channel so its callbacks never run."""
+        task = self._tasks.pop(channel, None)
+        if task is not None:
+            # Only works if the job has not started yet, otherwise its result is ignored
+            task.future.cancel()
+
+    def busy(self, channel=None):
+        """This method will return True while a job (of the given channel, or of any channel) is pending."""
+        if channel is None:
+            return bool(self._tasks)
+        return channel in self._tasks
+
+    def shutdown(self):
+        """This method will cancel every pending job and stop the worker threads."""
+        for channel in list(self._tasks):
+            self.cancel(channel)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self, channel, task):
+        """This method checks on the Tk thread whether a job has finished and dispatches its result."""
+        if self._tasks.get(channel) is not task:
+            # Superseded or cancelled in the meantime
+            return
+        if not task.future.done():
+            self.root.after(self.poll_interval, self._poll, channel, task)
+            return
+
+        del self._tasks[channel]
+        error = task.future.exception()
+        if error is not None:
+            if task.on_error is not None:
+                task.on_error(error)
+        elif task.on_done is not None:
+            task.on_done(task.future.result())
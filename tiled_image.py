@@ -0,0 +1,186 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from image_processor import ImageProcessor
+
+
+# Default edge length of a tile in pixels
+DEFAULT_TILE_SIZE = 1024
+
+# Extra pixels every tile needs around it so neighbourhood operations give the same result as on the whole image
+OPERATION_HALO = {
+    # Gaussian kernel of size k reaches k // 2 pixels out (the kernel size is made odd like in apply_blur)
+    "apply_blur": lambda kernel_size: (kernel_size if kernel_size % 2 == 1 else kernel_size + 1) // 2,
+    # Sobel and non-maximum suppression only need a couple of pixels, the rest covers most hysteresis chains
+    "detect_edges": lambda: 16,
+    # OpenCV rounds the last pixels of a row differently in HSV to BGR, so a few values can differ by one level next to tile edges
+    "adjust_brightness": lambda value: 0,
+    "adjust_contrast": lambda factor: 0,
+    "to_grayscale": lambda: 0,
+    "to_grayscale_bgr": lambda: 0,
+}
+
+
+def _transformed_box(name, arg, box, shape):
+    """This function will return where a tile (y0, y1, x0, x1) of an image with the given shape ends up after a rotation or flip."""
+    y0, y1, x0, x1 = box
+    h, w = shape[:2]
+    if name == "flip_image":
+        if arg == 0:
+            return h - y1, h - y0, x0, x1
+        return y0, y1, w - x1, w - x0
+    if arg == 90:
+        return x0, x1, h - y1, h - y0
+    if arg == 180:
+        return h - y1, h - y0, w - x1, w - x0
+    if arg == 270:
+        return w - x1, w - x0, y0, y1
+    return box
+
+
+class TiledImage:
+    """
+    Class that holds an image in a memory-mapped .npy file and runs ImageProcessor operations on it tile by tile.
+    Only the tiles being worked on are in RAM, so peak memory depends on the tile size and the number of worker threads instead of the image size. OpenCV releases the GIL, so tiles are processed in parallel on a thread pool.
+    """
+
+    def __init__(self, array, tile_size=DEFAULT_TILE_SIZE, path=None):
+        self.array = array
+        self.tile_size = tile_size
+        self.path = path
+
+    @classmethod
+    def create(cls, path, shape, dtype=np.uint8, tile_size=DEFAULT_TILE_SIZE):
+        """This method will create a new memory-mapped image file of the given shape."""
+        array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=tuple(shape))
+        return cls(array, tile_size, path)
+
+    @classmethod
+    def open(cls, path, tile_size=DEFAULT_TILE_SIZE, mode="r"):
+        """This method will memory-map an existing .npy image file without reading it into RAM."""
+        return cls(np.load(path, mmap_mode=mode), tile_size, path)
+
+    @classmethod
+    def from_file(cls, src, path=None, tile_size=DEFAULT_TILE_SIZE):
+        """This method will open an image for tiled processing. A .npy file is mapped directly, any other format is decoded once with cv2.imread and copied into a memory-mapped file so all later work is out-of-core. The decode needs the whole image in RAM, so only .npy inputs stay below the image size."""
+        if src.lower().endswith(".npy"):
+            return cls.open(src, tile_size)
+        # Same flags as the editor and the untiled batch path, so the same file gives the same 8-bit pixels
+        image = cv2.imread(src, cv2.IMREAD_ANYCOLOR)
+        if image is None:
+            raise ValueError(f"Could not load image: {src}")
+        tiled = cls.create(path or _temp_path(), image.shape, image.dtype, tile_size)
+        tiled.array[:] = image
+        tiled.array.flush()
+        return tiled
+
+    @property
+    def shape(self):
+        """This property will return the shape of the whole image."""
+        return self.array.shape
+
+    def tiles(self):
+        """This method will yield the (y0, y1, x0, x1) box of every tile."""
+        h, w = self.shape[:2]
+        for y in range(0, h, self.tile_size):
+            for x in range(0, w, self.tile_size):
+                yield y, min(y + self.tile_size, h), x, min(x + self.tile_size, w)
+
+    def read_tile(self, box, halo=0):
+        """This method will copy a tile plus a halo of surrounding pixels (clipped to the image) into RAM, and return it with the position of the tile inside the copy."""
+        y0, y1, x0, x1 = box
+        h, w = self.shape[:2]
+        top, left = max(y0 - halo, 0), max(x0 - halo, 0)
+        tile = np.ascontiguousarray(self.array[top:min(y1 + halo, h), left:min(x1 + halo, w)])
+        return tile, (y0 - top, y1 - top, x0 - left, x1 - left)
+
+    def map(self, func, halo=0, path=None, workers=None):
+        """This method will run func on every tile (with the given halo) and write the results into a new TiledImage. func may change the number of channels or the dtype but not the size of the tile."""
+        boxes = list(self.tiles())
+        # The first tile tells what the output looks like
+        first = self._run_tile(func, boxes[0], halo)
+        out = TiledImage.create(path or _temp_path(), self.shape[:2] + first.shape[2:], first.dtype, self.tile_size)
+        y0, y1, x0, x1 = boxes[0]
+        out.array[y0:y1, x0:x1] = first
+
+        def work(box):
+            y0, y1, x0, x1 = box
+            out.array[y0:y1, x0:x1] = self._run_tile(func, box, halo)
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            list(pool.map(work, boxes[1:]))
+        out.array.flush()
+        return out
+
+    def transform(self, name, arg, path=None, workers=None):
+        """This method will rotate or flip the image tile by tile, writing every tile straight to its new position."""
+        h, w = self.shape[:2]
+        swap = name == "rotate_image" and arg in (90, 270)
+        shape = ((w, h) if swap else (h, w)) + self.shape[2:]
+        out = TiledImage.create(path or _temp_path(), shape, self.array.dtype, self.tile_size)
+        method = getattr(ImageProcessor, name)
+
+        def work(box):
+            ty0, ty1, tx0, tx1 = _transformed_box(name, arg, box, self.shape)
+            tile, _ = self.read_tile(box)
+            out.array[ty0:ty1, tx0:tx1] = method(tile, arg)
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            list(pool.map(work, self.tiles()))
+        out.array.flush()
+        return out
+
+    def run_operations(self, operations, workers=None):
+        """This method will apply a list of (method name, args...) tuples. Consecutive non-geometric operations are run together in one pass over the tiles with their halos added up, rotations and flips are done as separate passes. Resizing isn't supported."""
+        result = self
+        chain = []
+
+        def advance(image):
+            # Intermediate files are deleted as soon as the next pass has been written
+            nonlocal result
+            if result is not self:
+                result.close(delete=True)
+            result = image
+
+        def run_chain():
+            if chain:
+                halo = sum(OPERATION_HALO[name](*args) for name, *args in chain)
+                steps = list(chain)
+                chain.clear()
+                advance(result.map(lambda tile: ImageProcessor.run_pipeline(tile, steps), halo, workers=workers))
+
+        for name, *args in operations:
+            if name in ("rotate_image", "flip_image"):
+                run_chain()
+                advance(result.transform(name, *args, workers=workers))
+            elif name in OPERATION_HALO:
+                chain.append((name, *args))
+            else:
+                raise ValueError(f"{name} can't be run on tiles")
+        run_chain()
+        return result
+
+    def save(self, path, params=None):
+        """This method will encode the image into a regular image file."""
+        if not cv2.imwrite(path, self.array, params or []):
+            raise ValueError(f"Could not write image: {path}")
+
+    def close(self, delete=False):
+        """This method will release the memory map and optionally delete its file."""
+        self.array = None
+        if delete and self.path:
+            os.remove(self.path)
+
+    def _run_tile(self, func, box, halo):
+        """This method will process one tile and cut the halo off the result."""
+        tile, (y0, y1, x0, x1) = self.read_tile(box, halo)
+        return func(tile)[y0:y1, x0:x1]
+
+
+def _temp_path():
+    """This function will return a new path for an intermediate memory-mapped file."""
+    fd, path = tempfile.mkstemp(prefix="tiled_", suffix=".npy")
+    os.close(fd)
+    return path